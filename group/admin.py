@@ -6,7 +6,7 @@ from .models import Group, GroupMembership, GroupMembershipRequest
 
 class GroupAdmin(admin.ModelAdmin):
     model = Group
-    raw_id_fields = ('members',)
+    raw_id_fields = ('members', 'parent')
 
 
 class GroupMembershipAdmin(admin.ModelAdmin):
@@ -0,0 +1,233 @@
+from functools import wraps
+
+from django.contrib.auth.decorators import login_required
+from django.core.paginator import InvalidPage, Paginator
+from django.http import Http404, JsonResponse
+from django.views.decorators.http import condition, require_http_methods
+
+from .caches import get_version
+from .models import Group, GroupMembership, GroupMembershipEvent, GroupMembershipRequest
+from .permissions import has_group_permission
+
+# Create your api views here.
+
+MEMBERS_PER_PAGE = 100
+
+
+def make_etag(key_type, pk):
+    """
+    Build the entity tag of a resource from its cache version.
+    """
+    version = get_version(key_type, pk)
+    etag = '{pk}-{version}'.format(pk=pk, version=version)
+    return etag
+
+
+def group_etag(request, group_id, *args, **kwargs):
+    """
+    Entity tag of a group and its members.
+    """
+    return make_etag('memberships_version', group_id)
+
+
+def user_groups_etag(request, *args, **kwargs):
+    """
+    Entity tag of the current user groups.
+    """
+    return make_etag('groups_version', request.user.pk)
+
+
+def user_requests_etag(request, *args, **kwargs):
+    """
+    Entity tag of the current user membership requests.
+    """
+    return make_etag('requests_version', request.user.pk)
+
+
+def get_group_or_404(group_id):
+    """
+    Return the group or raise a 404 error.
+    """
+    try:
+        return Group.objects.get(pk=group_id)
+    except Group.DoesNotExist:
+        raise Http404('Group does not exist.')
+
+
+def group_member_required(view):
+    """
+    Allow reading a private group only to its members, including
+    the members of its subgroups. Access is checked before the
+    entity tag so non-members cannot probe the group with
+    conditional requests.
+    """
+    @wraps(view)
+    def view_wrapper(request, group_id, *args, **kwargs):
+        group = get_group_or_404(group_id)
+        if group.access == 'PRIVATE' and not Group.objects.is_effective_member(request.user, group):
+            return JsonResponse({'detail': 'Permission denied.'}, status=403)
+        return view(request, group_id, *args, **kwargs)
+    return view_wrapper
+
+
+def serialize_group(group):
+    """
+    Build the JSON representation of a group.
+    """
+    return {
+        'id': group.pk,
+        'name': group.name,
+        'access': group.access,
+        'created': group.created.isoformat(),
+    }
+
+
+def serialize_membership(membership):
+    """
+    Build the JSON representation of a group member.
+    """
+    return {
+        'id': membership.member_id,
+        'username': membership.member.username,
+        'permit': membership.permit,
+        'date_joined': membership.date_joined.isoformat(),
+    }
+
+
+def serialize_request(membership_request):
+    """
+    Build the JSON representation of a membership request.
+    """
+    return {
+        'id': membership_request.pk,
+        'from_user': membership_request.from_user_id,
+        'group': membership_request.group_id,
+        'message': membership_request.message,
+        'created': membership_request.created.isoformat(),
+        'viewed': membership_request.viewed.isoformat() if membership_request.viewed else None,
+        'rejected': membership_request.rejected.isoformat() if membership_request.rejected else None,
+    }
+
+
+def serialize_event(event):
+    """
+    Build the JSON representation of a membership event.
+    """
+    return {
+        'id': event.pk,
+        'user': event.user_id,
+        'group': event.group_id,
+        'event': event.get_event_display(),
+        'created': event.created.isoformat(),
+    }
+
+
+def get_cursor(request):
+    """
+    Return the feed cursor from the query string.
+    """
+    try:
+        return int(request.GET['cursor'])
+    except (KeyError, ValueError):
+        return None
+
+
+def render_feed(events, cursor):
+    """
+    Build the JSON response for one page of an activity feed.
+    """
+    data = {
+        'events': [serialize_event(event) for event in events],
+        'cursor': cursor,
+    }
+    return JsonResponse(data)
+
+
+@login_required(login_url='/login/')
+@require_http_methods(['GET', 'HEAD'])
+@group_member_required
+@condition(etag_func=group_etag)
+def api_group_detail(request, group_id):
+    """
+    Return group information and members count as JSON.
+    Private groups are only shown to their members.
+    """
+    group = get_group_or_404(group_id)
+    data = serialize_group(group)
+    data['members_count'] = GroupMembership.objects.count_group_members(group)
+    return JsonResponse(data)
+
+
+@login_required(login_url='/login/')
+@require_http_methods(['GET', 'HEAD'])
+@group_member_required
+@condition(etag_func=group_etag)
+def api_group_members(request, group_id):
+    """
+    Return one page of group members as JSON.
+    The page is selected with the 'page' query parameter.
+    Private groups are only shown to their members.
+    """
+    group = get_group_or_404(group_id)
+    memberships, members = GroupMembership.objects.memberships(group)
+    paginator = Paginator(memberships, MEMBERS_PER_PAGE)
+    try:
+        page = paginator.page(request.GET.get('page', 1))
+    except InvalidPage:
+        raise Http404('Page does not exist.')
+    data = {
+        'count': paginator.count,
+        'page': page.number,
+        'num_pages': paginator.num_pages,
+        'members': [serialize_membership(membership) for membership in page.object_list],
+    }
+    return JsonResponse(data)
+
+
+@login_required(login_url='/login/')
+@require_http_methods(['GET', 'HEAD'])
+@condition(etag_func=user_groups_etag)
+def api_user_groups(request):
+    """
+    Return the groups of the current user as JSON.
+    """
+    groups = Group.objects.get_user_groups(user=request.user)
+    data = {'groups': [serialize_group(group) for group in groups]}
+    return JsonResponse(data)
+
+
+@login_required(login_url='/login/')
+@require_http_methods(['GET', 'HEAD'])
+@condition(etag_func=user_requests_etag)
+def api_membership_requests(request):
+    """
+    Return the membership requests of the groups the
+    current user owns or moderates as JSON.
+    """
+    requests = GroupMembershipRequest.objects.requests(user=request.user)
+    data = {'requests': [serialize_request(membership_request) for membership_request in requests]}
+    return JsonResponse(data)
+
+
+@login_required(login_url='/login/')
+@require_http_methods(['GET'])
+def api_group_activity(request, group_id):
+    """
+    Return the membership activity feed of a group as JSON.
+    Only members allowed to manage requests can read it.
+    """
+    group = get_group_or_404(group_id)
+    if not has_group_permission(request.user, group, 'manage_requests'):
+        return JsonResponse({'detail': 'Permission denied.'}, status=403)
+    events, cursor = GroupMembershipEvent.objects.group_feed(group, cursor=get_cursor(request))
+    return render_feed(events, cursor)
+
+
+@login_required(login_url='/login/')
+@require_http_methods(['GET'])
+def api_user_activity(request):
+    """
+    Return the membership activity feed of the current user as JSON.
+    """
+    events, cursor = GroupMembershipEvent.objects.user_feed(request.user, cursor=get_cursor(request))
+    return render_feed(events, cursor)
@@ -1,14 +1,43 @@
+import os
+import sys
+import threading
+
 from django.apps import AppConfig
+from django.conf import settings
 from django.utils.translation import ugettext_lazy as _
 
-from .signals import (group_created, group_removed, group_and_membership_remove,
-                      membership_request_accepted, membership_request_rejected,
-                      membership_request_viewed, membership_request_sent,
-                      membership_created, membership_removed)
-from .signals import (create_group_admin, remove_group_and_memberships)
-
 # Define your app configuration here.
 
+# Signal receivers connected when the app is ready:
+# (signal, receiver, sender model name), all from the signals module.
+RECEIVERS = (
+    ('group_created', 'create_group_admin', 'Group'),
+    ('group_and_membership_remove', 'remove_group_and_memberships', 'Group'),
+    ('membership_created', 'log_membership_created', 'GroupMembership'),
+    ('membership_removed', 'log_membership_removed', 'GroupMembership'),
+    ('membership_synced', 'log_membership_synced', 'GroupMembership'),
+    ('membership_request_accepted', 'log_membership_request_accepted', 'GroupMembershipRequest'),
+    ('membership_request_rejected', 'log_membership_request_rejected', 'GroupMembershipRequest'),
+)
+
+# Scripts running management commands.
+MANAGEMENT_SCRIPTS = ('manage.py', 'django-admin', 'django-admin.py')
+
+
+def is_management_command(argv=None):
+    """
+    Check if the process runs a management command, started
+    with manage.py, django-admin or "python -m django".
+    """
+    argv = sys.argv if argv is None else argv
+    if not argv:
+        return False
+    script = os.path.basename(argv[0])
+    if script == '__main__.py':
+        return os.path.basename(os.path.dirname(argv[0])) == 'django'
+    return script in MANAGEMENT_SCRIPTS
+
+
 class GroupConfig(AppConfig):
     name = 'group'
     label = 'group'
@@ -16,8 +45,36 @@ class GroupConfig(AppConfig):
 
     def ready(self):
         """
-        Connect signal receivers or import signals module.
+        Connect signal receivers. The signals module and the
+        sender models are only looked up here, once the app
+        registry is ready, so importing the app config does
+        not import the rest of the app.
+        """
+        from apps.group import signals
+        for signal, receiver, sender in RECEIVERS:
+            getattr(signals, signal).connect(
+                receiver=getattr(signals, receiver),
+                sender=self.get_model(sender),
+                dispatch_uid='group.{receiver}'.format(receiver=receiver),
+            )
+        self.warm_cache()
+
+    def warm_cache(self):
+        """
+        Prefill the cache in a background thread when the
+        GROUP_CACHE_WARMUP setting is enabled. The setting can
+        be True or a dictionary of keyword arguments for
+        'warm_cache' (groups, users, batch_size, rate).
+        Management commands, such as migrate, never warm the
+        cache and only the process holding the warm-up lock
+        does, so the workers of a deploy warm it once.
         """
-        from apps.group.models import Group
-        group_created.connect(receiver=create_group_admin, sender=Group)
-        group_and_membership_remove.connect(receiver=remove_group_and_memberships, sender=Group)
+        warmup = getattr(settings, 'GROUP_CACHE_WARMUP', False)
+        if warmup and not is_management_command():
+            from apps.group.caches import acquire_warmup_lock, warm_cache
+            if not acquire_warmup_lock():
+                return
+            kwargs = warmup if isinstance(warmup, dict) else {}
+            thread = threading.Thread(target=warm_cache, kwargs=kwargs, name='group-cache-warmup')
+            thread.daemon = True
+            thread.start()
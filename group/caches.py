@@ -1,4 +1,19 @@
+import datetime
+import json
+import os
+import pickle
+import queue
+import threading
+import time
+import uuid
+import weakref
+import zlib
+
+from django.conf import settings
 from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.db import DEFAULT_DB_ALIAS, models, transaction
+from django.utils.module_loading import import_string
 
 # Create your caches here.
 
@@ -6,27 +21,36 @@ CACHE_KEYS = {
     'user_keys': {
         # user primary key (pk = user.pk)
         'groups': 'grp_g-{pk}',
+        'effective_groups': 'grp_eg-{pk}',
         'requests': 'grp_r-{pk}',
         'sent_requests': 'grp_sr-{pk}',
         'viewed_requests': 'grp_vr-{pk}',
         'unviewed_requests': 'grp_uvr-{pk}',
         'rejected_requests': 'grp_rr-{pk}',
         'unrejected_requests': 'grp_urr-{pk}',
+        'groups_version': 'grp_g_v-{pk}',
+        'requests_version': 'grp_r_v-{pk}',
         },
     'group_keys': {
         # group primary key (pk = post.pk)
         'memberships': 'grp_ms-{pk}',
         'members': 'grp_mb-{pk}',
+        'roles': 'grp_rl-{pk}',
+        'memberships_version': 'grp_ms_v-{pk}',
     },
 }
 
 CACHE_BUST = {
     'groups': [
         'groups',
+        'effective_groups',
+        'groups_version',
     ],
     'memberships': [
         'memberships',
         'members',
+        'roles',
+        'memberships_version',
     ],
     'requests': [
         'requests',
@@ -34,6 +58,7 @@ CACHE_BUST = {
         'unviewed_requests',
         'rejected_requests',
         'unrejected_requests',
+        'requests_version',
     ],
     'sent_requests': [
         'sent_requests',
@@ -41,16 +66,214 @@ CACHE_BUST = {
 }
 
 
-def cache_bust(cache_types):
+class PickleCodec(object):
+    """
+    Serialize cache values with pickle, as the
+    cache backends do by default.
+    """
+
+    def encode(self, value):
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def decode(self, data):
+        return pickle.loads(data)
+
+
+class CompactCodec(object):
+    """
+    Serialize cache values made of lists, tuples, numbers
+    and strings with msgpack, or compact JSON when msgpack
+    is not installed. Payloads larger than 'threshold' bytes
+    are compressed with zlib. The first byte of the encoded
+    value flags whether it is compressed.
+    """
+    RAW = b'r'
+    ZLIB = b'z'
+
+    def __init__(self, threshold=4096, level=1):
+        self.threshold = threshold
+        self.level = level
+        try:
+            import msgpack
+        except ImportError:
+            msgpack = None
+        self.msgpack = msgpack
+
+    def dumps(self, value):
+        if self.msgpack is not None:
+            return self.msgpack.packb(value, use_bin_type=True)
+        return json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+    def loads(self, data):
+        if self.msgpack is not None:
+            return self.msgpack.unpackb(data, raw=False)
+        return json.loads(data.decode('utf-8'))
+
+    def encode(self, value):
+        payload = self.dumps(value)
+        if self.threshold is not None and len(payload) > self.threshold:
+            return self.ZLIB + zlib.compress(payload, self.level)
+        return self.RAW + payload
+
+    def decode(self, data):
+        flag, payload = data[:1], data[1:]
+        if flag == self.ZLIB:
+            payload = zlib.decompress(payload)
+        return self.loads(payload)
+
+
+_codec = None
+
+
+def get_codec():
+    """
+    Return the codec used for group cache values. It can be
+    set with the GROUP_CACHE_CODEC setting as a dotted path to
+    a codec class, instantiated with the GROUP_CACHE_CODEC_OPTIONS
+    setting as keyword arguments.
+    """
+    global _codec
+    if _codec is None:
+        codec_class = getattr(settings, 'GROUP_CACHE_CODEC', None)
+        codec_class = import_string(codec_class) if codec_class else CompactCodec
+        _codec = codec_class(**getattr(settings, 'GROUP_CACHE_CODEC_OPTIONS', {}))
+    return _codec
+
+
+def reset_codec(setting, **kwargs):
+    """
+    Drop the codec when its settings change, for example
+    with override_settings, so the next value uses them.
+    """
+    global _codec
+    if setting in ('GROUP_CACHE_CODEC', 'GROUP_CACHE_CODEC_OPTIONS'):
+        _codec = None
+
+
+setting_changed.connect(reset_codec, dispatch_uid='group.reset_codec')
+
+
+_pending = threading.local()
+
+
+class PendingBust(object):
+    """
+    Cache keys collected during a transaction or savepoint of
+    a database connection. The first one called back when the
+    transaction commits deletes the keys of every pending set
+    of the connection in a single round trip.
+    """
+
+    def __init__(self, using):
+        self.using = using
+        self.keys = set()
+        self.flushed = False
+
+    def __call__(self):
+        keys = set()
+        for pending in list(get_pending_busts().values()):
+            if pending.using == self.using and not pending.flushed:
+                pending.flushed = True
+                keys.update(pending.keys)
+        if keys:
+            delete_keys(list(keys))
+
+
+def get_pending_busts():
+    """
+    Return the pending sets of keys of the current thread, by
+    database alias and savepoints. Only on_commit holds the sets,
+    so when Django drops the callbacks of a rolled back transaction
+    or savepoint their keys are dropped with them.
+    """
+    if not hasattr(_pending, 'busts'):
+        _pending.busts = weakref.WeakValueDictionary()
+    return _pending.busts
+
+
+def get_pending_bust(using=None):
+    """
+    Return a tuple (pending, registered) with the keys waiting to
+    be busted when the current transaction or savepoint of a database
+    connection commits and whether they are already registered with
+    on_commit. A new set is started for each savepoint and once the
+    previous set has been flushed or dropped by a rollback.
+    """
+    using = using or DEFAULT_DB_ALIAS
+    connection = transaction.get_connection(using)
+    busts = get_pending_busts()
+    scope = (using, tuple(connection.savepoint_ids))
+    pending = busts.get(scope)
+    if pending is not None and not pending.flushed:
+        return pending, True
+    pending = busts[scope] = PendingBust(using)
+    return pending, False
+
+
+_delayed = queue.Queue()
+_delayed_lock = threading.Lock()
+_delayed_worker = None
+
+
+def run_delayed_deletes():
+    """
+    Delete the queued keys once they are due. All deletes are
+    queued with the same delay, so they are due in queue order.
+    """
+    while True:
+        due, keys = _delayed.get()
+        wait = due - time.time()
+        if wait > 0:
+            time.sleep(wait)
+        cache.delete_many(keys)
+
+
+def schedule_delete(keys, delay):
+    """
+    Queue a second delete of cache keys in 'delay' seconds.
+    Queued deletes are run by a single background thread,
+    started on first use and again if it has died.
+    """
+    global _delayed_worker
+    with _delayed_lock:
+        if _delayed_worker is None or not _delayed_worker.is_alive():
+            _delayed_worker = threading.Thread(target=run_delayed_deletes, name='group-cache-delete')
+            _delayed_worker.daemon = True
+            _delayed_worker.start()
+    _delayed.put((time.time() + delay, keys))
+
+
+def delete_keys(keys):
+    """
+    Delete cache keys in a single round trip. When the
+    GROUP_CACHE_DOUBLE_DELETE_DELAY setting is set, the keys
+    are deleted again after that many seconds to drop values
+    repopulated from lagging database replicas.
+    """
+    cache.delete_many(keys)
+    delay = getattr(settings, 'GROUP_CACHE_DOUBLE_DELETE_DELAY', None)
+    if delay:
+        schedule_delete(keys, delay)
+
+
+def cache_bust(cache_types, using=None):
     """
     Bust the cache for a given type.
     The 'cache_types' parameters is a list
-    of tuples (key_type, pk).
+    of tuples (key_type, pk). Inside a transaction
+    the keys are collected and deleted once, in a
+    single round trip, after the transaction commits,
+    so concurrent readers cannot cache uncommitted
+    state. Keys busted in a rolled back transaction
+    or savepoint are dropped. Outside a transaction
+    they are deleted right away.
     """
+    pending, registered = get_pending_bust(using)
     for key_type, pk in cache_types:
-        bust_types = CACHE_BUST.get(key_type, None)
-        keys = [make_key(to_bust, pk) for to_bust in bust_types]
-        cache.delete_many(keys)
+        bust_types = CACHE_BUST.get(key_type, [])
+        pending.keys.update(make_key(to_bust, pk) for to_bust in bust_types)
+    if pending.keys and not registered:
+        transaction.on_commit(pending, using=using)
 
 
 def make_key(key_type, pk):
@@ -60,10 +283,26 @@ def make_key(key_type, pk):
     key = CACHE_KEYS['user_keys'].get(key_type, None)
     if key is None:
         key = CACHE_KEYS['group_keys'].get(key_type)
-    key.format(pk=pk)
+    key = key.format(pk=pk)
     return key
 
 
+def get_version(key_type, pk):
+    """
+    Return the version of a cached resource. Version keys
+    are busted along with the values they describe and the
+    next read starts a new version from the current time in
+    milliseconds, so versions are never reused after a bust.
+    """
+    key = make_key(key_type, pk)
+    version = cache.get(key)
+    if version is None:
+        version = int(time.time() * 1000)
+        if not cache.add(key, version):
+            version = cache.get(key, version)
+    return version
+
+
 def make_key_many(cache_types):
     """
     Build the cache key for several cache values.
@@ -73,3 +312,207 @@ def make_key_many(cache_types):
         key = make_key(key_type, pk)
         keys.update({key_type: key})
     return keys
+
+
+def pack_value(value):
+    """
+    Convert a model field value into a codec friendly value.
+    """
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+
+def pack_instances(instances, fields):
+    """
+    Convert model instances into short rows holding only
+    the values of the given field attribute names.
+    """
+    return [[pack_value(getattr(instance, field)) for field in fields] for instance in instances]
+
+
+def unpack_instances(model, fields, rows, using=None):
+    """
+    Rebuild model instances from the rows built by 'pack_instances'.
+    Fields not stored in the rows are deferred and loaded on access.
+    """
+    concrete = [field for field in model._meta.concrete_fields if field.attname in fields]
+    positions = [fields.index(field.attname) for field in concrete]
+    field_names = [field.attname for field in concrete]
+    converters = [field.to_python if isinstance(field, models.DateField) else None for field in concrete]
+    instances = []
+    for row in rows:
+        values = [row[position] if convert is None else convert(row[position])
+                  for position, convert in zip(positions, converters)]
+        instances.append(model.from_db(using, field_names, values))
+    return instances
+
+
+def get_chunk_size():
+    """
+    Return the maximum size in bytes of a single cache entry.
+    Larger values are split in chunks. It can be set with the
+    GROUP_CACHE_CHUNK_SIZE setting and defaults to a margin
+    under the memcached 1 MB item limit.
+    """
+    return getattr(settings, 'GROUP_CACHE_CHUNK_SIZE', 1000 * 1000)
+
+
+def make_chunk_keys(key, manifest):
+    """
+    Build the cache keys of the chunks described by a manifest.
+    """
+    return ['{key}:{token}:{index}'.format(key=key, token=manifest['token'], index=index)
+            for index in range(manifest['chunks'])]
+
+
+def split_entries(key, data):
+    """
+    Split encoded data in the cache entries to write for a key.
+    Return a tuple (chunks, entry) where 'chunks' is a dictionary
+    of chunk keys and values, empty when the data fits in one entry,
+    and 'entry' is the value to store in the key itself: the data
+    or the manifest of the chunks. Each write uses a new token in
+    the chunk keys, so deleting the manifest invalidates all chunks
+    at once and readers never mix chunks of different writes.
+    """
+    size = get_chunk_size()
+    if len(data) <= size:
+        return {}, data
+    manifest = {'token': uuid.uuid4().hex, 'chunks': (len(data) + size - 1) // size}
+    keys = make_chunk_keys(key, manifest)
+    chunks = {chunk_key: data[index * size:(index + 1) * size] for index, chunk_key in enumerate(keys)}
+    return chunks, manifest
+
+
+def join_entries(key, entry):
+    """
+    Return the encoded data of a cache entry, reading its
+    chunks with a single get_many when it is a manifest.
+    Return None if any chunk has been evicted.
+    """
+    if not isinstance(entry, dict):
+        return entry
+    keys = make_chunk_keys(key, entry)
+    chunks = cache.get_many(keys)
+    if len(chunks) < len(keys):
+        return None
+    return b''.join(chunks[chunk_key] for chunk_key in keys)
+
+
+def cache_get(key):
+    """
+    Return the decoded cache value of a key or None.
+    """
+    data = join_entries(key, cache.get(key))
+    if data is None:
+        return None
+    return get_codec().decode(data)
+
+
+def cache_get_many(keys):
+    """
+    Return a dictionary with the decoded cache values of
+    the keys found in the cache, read with a single get_many.
+    """
+    codec = get_codec()
+    values = {}
+    for key, entry in cache.get_many(keys).items():
+        data = join_entries(key, entry)
+        if data is not None:
+            values[key] = codec.decode(data)
+    return values
+
+
+def cache_set(key, value):
+    """
+    Encode and store a cache value. Chunks are written
+    before the manifest that makes them reachable.
+    """
+    chunks, entry = split_entries(key, get_codec().encode(value))
+    if chunks:
+        cache.set_many(chunks)
+    cache.set(key, entry)
+
+
+def get_instances(key, model, fields, using=None):
+    """
+    Return the model instances cached in a key or None.
+    """
+    rows = cache_get(key)
+    if rows is None:
+        return None
+    return unpack_instances(model, fields, rows, using=using)
+
+
+def set_instances(key, instances, fields):
+    """
+    Cache model instances as short rows of the given fields.
+    """
+    cache_set(key, pack_instances(instances, fields))
+
+
+def cache_set_many(values, batch_size=100):
+    """
+    Encode and store a dictionary of cache values
+    in batches of 'batch_size' keys per round trip.
+    The chunks of large values are written first.
+    """
+    codec = get_codec()
+    chunks, entries = [], []
+    for key, value in values.items():
+        value_chunks, entry = split_entries(key, codec.encode(value))
+        chunks.extend(value_chunks.items())
+        entries.append((key, entry))
+    for items in (chunks, entries):
+        for start in range(0, len(items), batch_size):
+            cache.set_many(dict(items[start:start + batch_size]))
+    return len(entries)
+
+
+WARMUP_LOCK_KEY = 'grp_warmup'
+
+
+def acquire_warmup_lock():
+    """
+    Return True for the single process allowed to warm the
+    cache. The lock expires after the number of seconds set
+    with the GROUP_CACHE_WARMUP_LOCK_TIMEOUT setting, 10
+    minutes by default, so the next deploy warms it again.
+    """
+    timeout = getattr(settings, 'GROUP_CACHE_WARMUP_LOCK_TIMEOUT', 600)
+    return cache.add(WARMUP_LOCK_KEY, os.getpid(), timeout)
+
+
+def warm_cache(groups=100, users=100, batch_size=100, rate=None):
+    """
+    Prefill the cache for the top most active groups and users.
+    Groups are ranked by number of members and users by number
+    of group memberships. The users allowed to manage the requests
+    of the selected groups also get their request inbox prefilled.
+    The 'rate' parameter limits the number of batches loaded
+    per second to avoid flooding the database and the cache.
+    Return the number of cache keys written.
+    """
+    from django.contrib.auth.models import User
+    from django.db.models import Count
+    from apps.group.models import Group, GroupMembership, GroupMembershipRequest
+    from apps.group.permissions import get_permitted_users
+    group_pks = list(Group.objects.annotate(num_members=Count('members'))
+                     .order_by('-num_members').values_list('pk', flat=True)[:groups])
+    user_pks = list(User.objects.annotate(num_groups=Count('groupmembership'))
+                    .order_by('-num_groups').values_list('pk', flat=True)[:users])
+    manager_pks = get_permitted_users(group_pks, 'manage_requests')
+    written = 0
+    prefills = [
+        (GroupMembership.objects, group_pks),
+        (Group.objects, user_pks),
+        (GroupMembershipRequest.objects, manager_pks),
+    ]
+    for manager, pks in prefills:
+        for start in range(0, len(pks), batch_size):
+            if written and rate:
+                time.sleep(1.0 / rate)
+            values = manager.prefill_cache(pks[start:start + batch_size])
+            written += cache_set_many(values, batch_size=batch_size)
+    return written
@@ -1,15 +1,36 @@
 from functools import wraps
 
+from django.http import HttpResponseForbidden
+
+from apps.group.permissions import has_group_permission
+
 # Create your decorators here.
 
 def group_admin_permit_required(method):
+    """
+    Allow a membership request method only to group members
+    whose roles grant the 'manage_requests' permission (the
+    group owner and moderators), resolved through the cached
+    group role table.
+    """
     @wraps(method)
     def method_wrapper(self, user, group, *args, **kwargs):
-        if callable(getattr(self, method.__name__, None)):
-            if user.is_authenticated():
-                from apps.group.models import GroupMembership
-                admin = GroupMembership.objects.get_group_admin(group)
-                if user == self.to_administrator and user == admin:
-                    return method(self, user, group, *args, **kwargs)
+        if group.pk == self.group_id and has_group_permission(user, group, 'manage_requests'):
+            return method(self, user, group, *args, **kwargs)
         return False
     return method_wrapper
+
+
+def group_permission_required(permission):
+    """
+    Allow a view only to users whose roles grant a permission
+    in the group selected by the 'group_id' url argument.
+    """
+    def decorator(view):
+        @wraps(view)
+        def view_wrapper(request, group_id, *args, **kwargs):
+            if not has_group_permission(request.user, group_id, permission):
+                return HttpResponseForbidden()
+            return view(request, group_id, *args, **kwargs)
+        return view_wrapper
+    return decorator
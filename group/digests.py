@@ -0,0 +1,153 @@
+import json
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from apps.group.permissions import PERMISSIONS, get_role_tables
+
+# Create your digests here.
+
+class BaseDigestBackend(object):
+    """
+    Base class of the digest delivery backends.
+    Each digest is a dictionary with the 'administrator'
+    user, the group owner or a moderator, and the list of
+    pending 'requests' of the groups they manage.
+    """
+
+    def send_digests(self, digests):
+        """
+        Deliver a batch of digests and return the number delivered.
+        """
+        raise NotImplementedError('Digest backends must implement send_digests().')
+
+    def format_digest(self, digest):
+        """
+        Build a plain data representation of a digest.
+        """
+        return {
+            'administrator': digest['administrator'].pk,
+            'email': digest['administrator'].email,
+            'count': len(digest['requests']),
+            'requests': [{
+                'id': request.pk,
+                'from_user': request.from_user.username,
+                'group': request.group.name,
+                'message': request.message,
+                'created': request.created.isoformat(),
+            } for request in digest['requests']],
+        }
+
+
+class ConsoleDigestBackend(BaseDigestBackend):
+    """
+    Write digests to a stream, the standard output by default.
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+
+    def send_digests(self, digests):
+        """
+        Write a summary of each digest to the stream.
+        """
+        for digest in digests:
+            data = self.format_digest(digest)
+            self.stream.write('{count} pending membership requests for administrator {administrator}\n'.format(**data))
+            for request in data['requests']:
+                self.stream.write('  {from_user} wants to join {group}: {message}\n'.format(**request))
+        return len(digests)
+
+
+class FileDigestBackend(BaseDigestBackend):
+    """
+    Append digests to a file, one JSON document per line.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def send_digests(self, digests):
+        """
+        Append each digest to the file.
+        """
+        with open(self.path, 'a') as digest_file:
+            for digest in digests:
+                digest_file.write(json.dumps(self.format_digest(digest)) + '\n')
+        return len(digests)
+
+
+def get_backend():
+    """
+    Return the digest delivery backend set with the GROUP_DIGEST_BACKEND
+    setting as a dotted path, instantiated with the GROUP_DIGEST_BACKEND_OPTIONS
+    setting as keyword arguments. Digests are written to the console by default.
+    """
+    backend_class = getattr(settings, 'GROUP_DIGEST_BACKEND', None)
+    backend_class = import_string(backend_class) if backend_class else ConsoleDigestBackend
+    return backend_class(**getattr(settings, 'GROUP_DIGEST_BACKEND_OPTIONS', {}))
+
+
+def build_digests(digest_run, batch_size=500):
+    """
+    Yield lists of digests for the users allowed to manage the
+    requests of groups with unviewed and unrejected membership
+    requests covered by a digest run: the group owners and
+    moderators. The recipients of each group are read from its
+    role table and the requests of each batch of 'batch_size'
+    recipients are loaded with a single query.
+    """
+    from apps.group.models import GroupMembershipRequest
+    pending = GroupMembershipRequest.objects.filter(digest=digest_run, viewed__isnull=True, rejected__isnull=True)
+    group_pks = list(pending.order_by('group').values_list('group', flat=True).distinct())
+    bit = PERMISSIONS['manage_requests']
+    recipient_groups = defaultdict(set)
+    for group_pk, table in get_role_tables(group_pks).items():
+        for user_pk, mask in table.items():
+            if mask & bit:
+                recipient_groups[user_pk].add(group_pk)
+    recipients = sorted(recipient_groups)
+    user_model = GroupMembershipRequest._meta.get_field('from_user').related_model
+    for start in range(0, len(recipients), batch_size):
+        batch = recipients[start:start + batch_size]
+        users = user_model.objects.in_bulk(batch)
+        groups = set().union(*(recipient_groups[pk] for pk in batch))
+        requests = defaultdict(list)
+        for request in pending.filter(group__in=groups).select_related('from_user', 'group').order_by('created'):
+            requests[request.group_id].append(request)
+        digests = []
+        for pk in batch:
+            if pk in users:
+                user_requests = [request for group_pk in recipient_groups[pk] for request in requests[group_pk]]
+                user_requests.sort(key=lambda request: request.created)
+                digests.append({'administrator': users[pk], 'requests': user_requests})
+        yield digests
+
+
+def send_digests(batch_size=500, backend=None):
+    """
+    Build and deliver the digests of the pending requests not covered
+    by a previous run. The requests are marked as covered by the run
+    before the delivery, which runs outside of any transaction. When
+    the delivery fails the requests not included in any delivered
+    digest are released for the next run, so delivered digests are
+    not sent again.
+    Return the number of digests delivered.
+    """
+    from apps.group.models import GroupMembershipDigest
+    backend = backend or get_backend()
+    digest_run = GroupMembershipDigest.objects.claim()
+    delivered, delivered_pks = 0, set()
+    try:
+        for digests in build_digests(digest_run, batch_size=batch_size):
+            delivered += backend.send_digests(digests)
+            delivered_pks.update(request.pk for digest in digests for request in digest['requests'])
+    except Exception:
+        GroupMembershipDigest.objects.release(digest_run, delivered_pks)
+        raise
+    finally:
+        digest_run.delivered = delivered
+        digest_run.save(update_fields=['delivered'])
+    return delivered
@@ -31,3 +31,12 @@ class SendRequestError(ValidationError):
     request to a group already sent.
     """
     pass
+
+
+class RequestThrottledError(ValidationError):
+    """
+    Raise error when a user sends or an administrator
+    receives too many membership requests in a short
+    period of time.
+    """
+    pass
@@ -0,0 +1,60 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from apps.group.models import (ArchivedGroupMembership, ArchivedGroupMembershipRequest, GroupMembership,
+                               GroupMembershipRequest)
+
+# Create your commands here.
+
+class Command(BaseCommand):
+    help = ('Move rejected and old membership requests, and optionally the memberships '
+            'of deactivated users, to the archive tables.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rejected-days',
+            type=int,
+            default=7,
+            help='Archive requests rejected more than this number of days ago.',
+        )
+        parser.add_argument(
+            '--request-days',
+            type=int,
+            default=90,
+            help='Archive pending requests created more than this number of days ago.',
+        )
+        parser.add_argument(
+            '--inactive-members',
+            action='store_true',
+            help='Archive the memberships of deactivated users, except group administrators.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of rows moved per transaction.',
+        )
+
+    def handle(self, *args, **options):
+        """
+        Archive membership requests and memberships and
+        report the number of archived rows.
+        """
+        now = timezone.now()
+        rejected = GroupMembershipRequest.objects.filter(
+            rejected__lt=now - datetime.timedelta(days=options['rejected_days']))
+        expired = GroupMembershipRequest.objects.filter(
+            created__lt=now - datetime.timedelta(days=options['request_days']), rejected__isnull=True)
+        archived = 0
+        for requests, outcome in ((rejected, ArchivedGroupMembershipRequest.REJECTED),
+                                  (expired, ArchivedGroupMembershipRequest.EXPIRED)):
+            archived += ArchivedGroupMembershipRequest.objects.archive(
+                requests, batch_size=options['batch_size'], outcome=outcome)
+        self.stdout.write('Archived {count} membership requests.'.format(count=archived))
+        if options['inactive_members']:
+            inactive = GroupMembership.objects.filter(member__is_active=False).exclude(permit='ADMIN')
+            archived = ArchivedGroupMembership.objects.archive(
+                inactive, batch_size=options['batch_size'], outcome=ArchivedGroupMembership.INACTIVE)
+            self.stdout.write('Archived {count} memberships.'.format(count=archived))
@@ -0,0 +1,91 @@
+import datetime
+import pickle
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from apps.group.caches import CompactCodec, PickleCodec, get_codec, pack_instances, unpack_instances
+from apps.group.managers import MEMBER_CACHE_FIELDS, MEMBERSHIP_CACHE_FIELDS
+from apps.group.models import GroupMembership
+
+# Create your commands here.
+
+class Command(BaseCommand):
+    help = 'Compare payload size and encode/decode time of the group cache codec against pickle.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            type=int,
+            nargs='+',
+            default=[10, 1000, 100000],
+            help='Number of group members of each benchmarked payload.',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=3,
+            help='Number of timed runs; the best one is reported.',
+        )
+
+    def build_members(self, size):
+        """
+        Build unsaved memberships and members of a synthetic group.
+        """
+        today = datetime.date.today()
+        members = [User(id=pk, username='user{pk}'.format(pk=pk), first_name='First', last_name='Last')
+                   for pk in range(1, size + 1)]
+        memberships = [GroupMembership(id=member.pk, member=member, group_id=1, permit='PART', date_joined=today)
+                       for member in members]
+        return memberships, members
+
+    def timed(self, function, repeat):
+        """
+        Return the result and the best time in milliseconds of a function.
+        """
+        best = None
+        for run in range(repeat):
+            start = time.perf_counter()
+            result = function()
+            elapsed = (time.perf_counter() - start) * 1000
+            best = elapsed if best is None else min(best, elapsed)
+        return result, best
+
+    def encode(self, codec, memberships, members):
+        """
+        Encode memberships and members as the managers cache them.
+        """
+        return (codec.encode(pack_instances(memberships, MEMBERSHIP_CACHE_FIELDS)),
+                codec.encode(pack_instances(members, MEMBER_CACHE_FIELDS)))
+
+    def decode(self, codec, memberships, members):
+        """
+        Decode memberships and members as the managers read them.
+        """
+        return (unpack_instances(GroupMembership, MEMBERSHIP_CACHE_FIELDS, codec.decode(memberships)),
+                unpack_instances(User, MEMBER_CACHE_FIELDS, codec.decode(members)))
+
+    def handle(self, *args, **options):
+        """
+        Print payload size and timings for each benchmarked size.
+        """
+        repeat = options['repeat']
+        codecs = [('pickle rows', PickleCodec()), ('compact', CompactCodec())]
+        if not isinstance(get_codec(), (PickleCodec, CompactCodec)):
+            codecs.append(('configured', get_codec()))
+        row = '{size:>8} {name:<16} {bytes:>12} {encode:>12.2f} {decode:>12.2f}'
+        self.stdout.write('{:>8} {:<16} {:>12} {:>12} {:>12}'.format(
+            'members', 'codec', 'bytes', 'encode ms', 'decode ms'))
+        for size in options['sizes']:
+            memberships, members = self.build_members(size)
+            values = (memberships, members)
+            pickled, encode = self.timed(lambda: pickle.dumps(values, pickle.HIGHEST_PROTOCOL), repeat)
+            result, decode = self.timed(lambda: pickle.loads(pickled), repeat)
+            self.stdout.write(row.format(size=size, name='pickle models', bytes=len(pickled),
+                                         encode=encode, decode=decode))
+            for name, codec in codecs:
+                encoded, encode = self.timed(lambda: self.encode(codec, memberships, members), repeat)
+                result, decode = self.timed(lambda: self.decode(codec, *encoded), repeat)
+                self.stdout.write(row.format(size=size, name=name, bytes=len(encoded[0]) + len(encoded[1]),
+                                             encode=encode, decode=decode))
@@ -0,0 +1,68 @@
+import os
+import subprocess
+import sys
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+# Create your commands here.
+
+SCRIPT = 'import django; django.setup(); import {modules}'
+
+
+class Command(BaseCommand):
+    help = ('Measure the import time of the group app with "python -X importtime" '
+            'in a fresh interpreter and fail when it exceeds a budget.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--budget-ms',
+            type=float,
+            default=None,
+            help='Fail when the total import time of the app modules, excluding their dependencies, exceeds it.',
+        )
+        parser.add_argument(
+            '--top',
+            type=int,
+            default=10,
+            help='Number of slowest app modules listed.',
+        )
+
+    def measure(self, package):
+        """
+        Import the app in a fresh interpreter and return a dictionary
+        {module: (self us, cumulative us)} of the app modules.
+        """
+        modules = ', '.join('{package}.{module}'.format(package=package, module=module)
+                            for module in ('models', 'urls', 'views', 'api'))
+        command = [sys.executable, '-X', 'importtime', '-c', SCRIPT.format(modules=modules)]
+        process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                 env=os.environ.copy(), universal_newlines=True)
+        if process.returncode:
+            raise CommandError(process.stderr.strip().splitlines()[-1])
+        timings = {}
+        for line in process.stderr.splitlines():
+            if not line.startswith('import time:') or '|' not in line:
+                continue
+            own, cumulative, name = [field.strip() for field in line[len('import time:'):].split('|')]
+            if name == package or name.startswith(package + '.'):
+                if own.isdigit():
+                    timings[name] = (int(own), int(cumulative))
+        return timings
+
+    def handle(self, *args, **options):
+        """
+        Print the import time of the app modules and check the budget.
+        """
+        package = apps.get_app_config('group').name
+        timings = self.measure(package)
+        total = sum(own for own, cumulative in timings.values()) / 1000.0
+        self.stdout.write('{:>10} {:>12}  module'.format('self ms', 'cumul. ms'))
+        slowest = sorted(timings.items(), key=lambda item: item[1][0], reverse=True)[:options['top']]
+        for name, (own, cumulative) in slowest:
+            self.stdout.write('{:>10.2f} {:>12.2f}  {}'.format(own / 1000.0, cumulative / 1000.0, name))
+        self.stdout.write('Total import time of {package}: {total:.2f} ms'.format(package=package, total=total))
+        budget = options['budget_ms']
+        if budget is not None and total > budget:
+            raise CommandError('Import time {total:.2f} ms exceeds the budget of {budget:.2f} ms.'.format(
+                total=total, budget=budget))
@@ -0,0 +1,265 @@
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, connection
+from django.db.models import Count, Q
+from django.test import RequestFactory
+from django.test.utils import override_settings
+from django.urls import resolve, reverse
+
+from apps.group.caches import get_instances, make_key
+from apps.group.exceptions import GroupError, GroupMembershipError, SendRequestError
+from apps.group.managers import MEMBER_CACHE_FIELDS
+from apps.group.models import (ArchivedGroupMembership, ArchivedGroupMembershipRequest, Group, GroupMembership,
+                               GroupMembershipEvent, GroupMembershipRequest)
+
+# Create your commands here.
+
+DEFAULT_MIX = 'read=10,join=4,leave=2,request=3,accept=2,create=1'
+
+# Application errors raised when an operation finds its work already done.
+DUPLICATE_ERRORS = (GroupError, GroupMembershipError, SendRequestError)
+
+
+def percentile(values, percent):
+    """
+    Return the percentile of a sorted list of values.
+    """
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(percent / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+class Command(BaseCommand):
+    help = ('Drive concurrent join/leave/request/accept traffic against the group views '
+            'and report throughput, latency, duplicate/integrity errors and cache staleness. '
+            'Run it against a local database and cache, never against production.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50, help='Number of simulated users.')
+        parser.add_argument('--groups', type=int, default=5, help='Number of groups, half of them private.')
+        parser.add_argument('--threads', type=int, default=8, help='Number of concurrent workers.')
+        parser.add_argument('--operations', type=int, default=200, help='Number of operations per worker.')
+        parser.add_argument('--mix', default=DEFAULT_MIX, help='Weights of each operation type.')
+        parser.add_argument('--prefix', default='loadtest', help='Prefix of the created users and groups.')
+        parser.add_argument('--seed', type=int, default=None, help='Random seed.')
+        parser.add_argument('--throttle', action='store_true', help='Keep the membership request throttling.')
+        parser.add_argument('--keep', action='store_true', help='Keep the created users and groups.')
+
+    def parse_mix(self, mix):
+        """
+        Parse the operation weights, e.g. 'read=10,join=4'.
+        """
+        weights = {}
+        for item in mix.split(','):
+            name, weight = item.split('=')
+            if not hasattr(self, 'op_{name}'.format(name=name)):
+                raise CommandError('Unknown operation \'{name}\'.'.format(name=name))
+            weights[name] = int(weight)
+        return weights
+
+    def setup_data(self, prefix, users, groups):
+        """
+        Create the simulated users and groups. The first
+        users become the administrators of the groups.
+        """
+        created = [User(username='{prefix}-{index}'.format(prefix=prefix, index=index)) for index in range(users)]
+        for user in created:
+            user.set_unusable_password()
+        User.objects.bulk_create(created)
+        self.users = list(User.objects.filter(username__startswith='{prefix}-'.format(prefix=prefix)))
+        self.groups = []
+        for index in range(groups):
+            access = 'PUBLIC' if index % 2 == 0 else 'PRIVATE'
+            name = '{prefix}-{index}'.format(prefix=prefix, index=index)
+            group, administrator = Group.objects.create_new_group(self.users[index % users], name, access)
+            self.groups.append(group)
+
+    def cleanup_data(self, prefix):
+        """
+        Delete the simulated users and groups, with the activity
+        events and archived rows referring to them. These tables
+        have no database constraints, so nothing cascades to them.
+        """
+        groups = Group.objects.filter(name__startswith='{prefix}-'.format(prefix=prefix))
+        users = User.objects.filter(username__startswith='{prefix}-'.format(prefix=prefix))
+        group_pks = list(groups.values_list('pk', flat=True))
+        user_pks = list(users.values_list('pk', flat=True))
+        GroupMembershipEvent.objects.filter(Q(group_id__in=group_pks) | Q(user_id__in=user_pks)).delete()
+        ArchivedGroupMembership.objects.filter(Q(group_id__in=group_pks) | Q(member_id__in=user_pks)).delete()
+        ArchivedGroupMembershipRequest.objects.filter(
+            Q(group_id__in=group_pks) | Q(from_user_id__in=user_pks) | Q(to_administrator_id__in=user_pks)).delete()
+        groups.delete()
+        users.delete()
+
+    def call_view(self, method, url, user, data=None):
+        """
+        Resolve and call the view of an url as a logged in user.
+        Views are called directly, without the test client, so
+        that exceptions are raised in the worker thread that
+        caused them.
+        """
+        request = getattr(self.factory, method)(url, data or {})
+        request.user = user
+        match = resolve(url)
+        return match.func(request, *match.args, **match.kwargs)
+
+    def op_read(self, user, group, rng):
+        """
+        Read the group detail or members API.
+        """
+        url = rng.choice(['api_group_detail', 'api_group_members'])
+        return self.call_view('get', reverse('group:{url}'.format(url=url), kwargs={'group_id': group.pk}), user)
+
+    def op_join(self, user, group, rng):
+        """
+        Join a public group or get redirected to the request form of a private one.
+        """
+        return self.call_view('get', reverse('group:group_join', kwargs={'group_id': group.pk}), user)
+
+    def op_leave(self, user, group, rng):
+        """
+        Leave a group the user is participant of.
+        """
+        membership = GroupMembership.objects.filter(member=user, group=group, permit='PART').first()
+        if membership is not None:
+            return membership.remove_membership(user)
+
+    def op_request(self, user, group, rng):
+        """
+        Submit the membership request form.
+        """
+        url = reverse('group:membership_request', kwargs={'group_id': group.pk})
+        return self.call_view('post', url, user, {'message': 'Load test request.'})
+
+    def op_accept(self, user, group, rng):
+        """
+        Accept the first pending request of a group as its administrator.
+        """
+        request = GroupMembershipRequest.objects.filter(group=group, rejected__isnull=True).first()
+        if request is not None:
+            administrator = GroupMembership.objects.get_group_admin(group)
+            return request.accept_membership_request(administrator, group)
+
+    def op_create(self, user, group, rng):
+        """
+        Submit the group creation form. Names are drawn from
+        a small pool to race on create_new_group.
+        """
+        name = '{prefix}-new-{index}'.format(prefix=self.prefix, index=rng.randint(0, 9))
+        return self.call_view('post', reverse('group:group_create'), user, {'name': name, 'access': 'PUBLIC'})
+
+    def worker(self, index, weights, operations, seed):
+        """
+        Run random operations as random users and record
+        the latency and outcome of each one.
+        """
+        rng = random.Random(seed + index if seed is not None else None)
+        names, values = list(weights), list(weights.values())
+        try:
+            for run in range(operations):
+                name = rng.choices(names, values)[0]
+                user, group = rng.choice(self.users), rng.choice(self.groups)
+                start = time.perf_counter()
+                try:
+                    getattr(self, 'op_{name}'.format(name=name))(user, group, rng)
+                    outcome = 'ok'
+                except DUPLICATE_ERRORS:
+                    outcome = 'duplicate'
+                except IntegrityError:
+                    outcome = 'integrity'
+                except ValidationError:
+                    outcome = 'duplicate'
+                except Exception as error:
+                    outcome = error.__class__.__name__
+                elapsed = (time.perf_counter() - start) * 1000
+                with self.lock:
+                    self.latencies[name].append(elapsed)
+                    self.outcomes[name, outcome] += 1
+        finally:
+            connection.close()
+
+    def check_staleness(self):
+        """
+        Count groups whose cached members differ from the database.
+        """
+        stale = 0
+        for group in self.groups:
+            members = get_instances(make_key('members', group.pk), User, MEMBER_CACHE_FIELDS)
+            if members is None:
+                continue
+            cached = set(member.pk for member in members)
+            stored = set(GroupMembership.objects.filter(group=group).values_list('member', flat=True))
+            if cached != stored:
+                stale += 1
+        return stale
+
+    def check_integrity(self, prefix):
+        """
+        Count duplicated groups, memberships and pending
+        membership requests left by races.
+        """
+        groups = Group.objects.filter(name__startswith='{prefix}-'.format(prefix=prefix))
+        duplicate_groups = groups.values('name').annotate(count=Count('pk')).filter(count__gt=1).count()
+        duplicate_memberships = GroupMembership.objects.filter(group__in=groups) \
+            .values('member', 'group').annotate(count=Count('pk')).filter(count__gt=1).count()
+        duplicate_requests = GroupMembershipRequest.objects.filter(group__in=groups, rejected__isnull=True) \
+            .values('from_user', 'group').annotate(count=Count('pk')).filter(count__gt=1).count()
+        return duplicate_groups, duplicate_memberships, duplicate_requests
+
+    def report(self, elapsed, options):
+        """
+        Print throughput, latency percentiles and outcomes.
+        """
+        total = sum(len(latencies) for latencies in self.latencies.values())
+        self.stdout.write('{total} operations in {elapsed:.2f}s: {rate:.1f} ops/s'.format(
+            total=total, elapsed=elapsed, rate=total / elapsed if elapsed else 0))
+        self.stdout.write('{:<10} {:>8} {:>10} {:>10}  outcomes'.format('operation', 'count', 'p50 ms', 'p99 ms'))
+        for name in sorted(self.latencies):
+            latencies = sorted(self.latencies[name])
+            outcomes = ', '.join('{outcome}={count}'.format(outcome=outcome, count=count)
+                                 for (operation, outcome), count in sorted(self.outcomes.items())
+                                 if operation == name)
+            self.stdout.write('{:<10} {:>8} {:>10.2f} {:>10.2f}  {}'.format(
+                name, len(latencies), percentile(latencies, 50), percentile(latencies, 99), outcomes))
+        duplicate_groups, duplicate_memberships, duplicate_requests = self.check_integrity(options['prefix'])
+        self.stdout.write('Duplicated groups: {groups}, duplicated memberships: {memberships}, '
+                          'duplicated pending requests: {requests}'.format(
+                              groups=duplicate_groups, memberships=duplicate_memberships,
+                              requests=duplicate_requests))
+        self.stdout.write('Groups with stale cached members: {stale}'.format(stale=self.check_staleness()))
+
+    def handle(self, *args, **options):
+        """
+        Set up the data, run the workers and report the results.
+        """
+        weights = self.parse_mix(options['mix'])
+        self.prefix = options['prefix']
+        if User.objects.filter(username__startswith='{prefix}-'.format(prefix=self.prefix)).exists():
+            raise CommandError('Data with prefix \'{prefix}\' already exists.'.format(prefix=self.prefix))
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.outcomes = Counter()
+        self.factory = RequestFactory()
+        rates = {} if options['throttle'] else {'user': (10 ** 9, 1), 'admin': (10 ** 9, 1)}
+        try:
+            with override_settings(GROUP_REQUEST_THROTTLE_RATES=rates):
+                self.setup_data(self.prefix, options['users'], options['groups'])
+                threads = [threading.Thread(target=self.worker,
+                                            args=(index, weights, options['operations'], options['seed']))
+                           for index in range(options['threads'])]
+                start = time.perf_counter()
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                self.report(time.perf_counter() - start, options)
+        finally:
+            if not options['keep']:
+                self.cleanup_data(self.prefix)
@@ -0,0 +1,33 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from apps.group.models import GroupMembershipEvent
+
+# Create your commands here.
+
+class Command(BaseCommand):
+    help = 'Delete membership activity events older than the retention period.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=90,
+            help='Retention period in days. Whole monthly partitions older than it are deleted.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of events deleted per transaction.',
+        )
+
+    def handle(self, *args, **options):
+        """
+        Prune the activity feed and report the number of deleted events.
+        """
+        before = timezone.now() - datetime.timedelta(days=options['days'])
+        deleted = GroupMembershipEvent.objects.prune(before=before, batch_size=options['batch_size'])
+        self.stdout.write('Deleted {count} membership events.'.format(count=deleted))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from apps.group.digests import send_digests
+
+# Create your commands here.
+
+class Command(BaseCommand):
+    help = ('Send group owners and moderators a digest of the pending membership requests '
+            'not included in a previous digest.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of recipients whose requests are loaded per query.',
+        )
+
+    def handle(self, *args, **options):
+        """
+        Send the digests and report the number delivered.
+        """
+        delivered = send_digests(batch_size=options['batch_size'])
+        self.stdout.write('Delivered {count} digests.'.format(count=delivered))
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+
+from apps.group.caches import warm_cache
+
+# Create your commands here.
+
+class Command(BaseCommand):
+    help = 'Prefill the group cache for the most active groups and users.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--groups',
+            type=int,
+            default=100,
+            help='Number of groups with most members to prefill.',
+        )
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=100,
+            help='Number of users with most memberships to prefill.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Number of objects loaded and cache keys written per batch.',
+        )
+        parser.add_argument(
+            '--rate',
+            type=float,
+            default=None,
+            help='Maximum number of batches loaded per second.',
+        )
+
+    def handle(self, *args, **options):
+        """
+        Warm the cache and report the number of keys written.
+        """
+        written = warm_cache(
+            groups=options['groups'],
+            users=options['users'],
+            batch_size=options['batch_size'],
+            rate=options['rate'],
+        )
+        self.stdout.write('Cache warmed with {count} keys.'.format(count=written))
@@ -1,27 +1,56 @@
-from django.db import models, transaction
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
 from django.urls import reverse
+from django.utils import timezone
 
-from apps.group.caches import cache_bust, make_key, make_key_many
-from apps.group.exceptions import GroupError, GroupMembershipError
-from apps.group.signals import group_created
+from apps.group.caches import (cache_bust, cache_set_many, get_instances, make_key, make_key_many,
+                               pack_instances, set_instances)
+from apps.group.exceptions import (GroupAdministratorError, GroupError, GroupMembershipError, RequestThrottledError,
+                                   SendRequestError)
+from apps.group.permissions import (ROLE_OWNER, get_permission_roles, get_permitted_users, get_role_bit,
+                                    has_group_permission, has_group_permissions)
+from apps.group.signals import (group_created, membership_created, membership_request_sent, membership_request_viewed,
+                                membership_synced)
+from apps.group.throttling import allow_membership_request
 
 # Create your managers here.
 
+# Model fields stored in the cache for each cached list of instances.
+GROUP_CACHE_FIELDS = ('id', 'name', 'access', 'created', 'parent_id')
+MEMBER_CACHE_FIELDS = ('id', 'username', 'first_name', 'last_name')
+MEMBERSHIP_CACHE_FIELDS = ('id', 'member_id', 'group_id', 'permit', 'date_joined', 'roles')
+REQUEST_CACHE_FIELDS = ('id', 'from_user_id', 'to_administrator_id', 'group_id',
+                        'message', 'created', 'rejected', 'viewed')
+
+
 class GroupManager(models.Manager):
     """
     Group model manager.
     """
 
-    def create_new_group(self, user, name, access='PRIVATE'):
+    @property
+    def closure(self):
+        """
+        Return the manager of the group hierarchy closure table.
+        """
+        return self.model._meta.get_field('ancestor_links').related_model.objects
+
+    def create_new_group(self, user, name, access='PRIVATE', parent=None):
         """
         Create a new group defined by its name and access type.
         Group access is set as private ('PRIV') by default.
+        The group can be created as a subgroup of a 'parent' group
+        by users allowed to edit the parent group.
         When created send signal to set administrator permit to the group creator.
         """
+        if parent is not None and not has_group_permission(user, parent, 'edit_group'):
+            raise GroupAdministratorError('User cannot add subgroups to this group.')
         if not self.filter(name=name).exists():
-            group, created = self.get_or_create(name=name, access=access)
+            group, created = self.get_or_create(name=name, access=access, parent=parent)
             if created:
-                response = group_created.send(sender=self.model.__class__, user=user, group=group)
+                self.closure.add_node(group)
+                response = group_created.send(sender=self.model, user=user, group=group)
                 receiver, administrator = response[0]
                 cache_bust([('groups', user.pk)])
                 return group, administrator
@@ -29,30 +58,141 @@ class GroupManager(models.Manager):
         else:
             raise GroupError('Already exists a group with name \'{name}\''.format(name=name))
 
-    def get_user_groups(self, user):
+    def get_user_groups(self, user, effective=False):
         """
         Return all group memberships for one user.
+        With 'effective' also return the groups the user belongs
+        to through membership of any of their subgroups.
         """
-        key = make_key('groups', user.pk)
-        groups = cache.get(key)
+        key = make_key('effective_groups' if effective else 'groups', user.pk)
+        groups = get_instances(key, self.model, GROUP_CACHE_FIELDS, using=self.db)
         if groups is None:
-            groups = self.filter(members=user).order_by('-date_joined')
-            cache.set(key, groups)
+            if effective:
+                groups = list(self.filter(descendant_links__descendant__groupmembership__member=user)
+                              .distinct().order_by('pk'))
+            else:
+                groups = list(self.filter(groupmembership__member=user).order_by('-groupmembership__date_joined'))
+            set_instances(key, groups, GROUP_CACHE_FIELDS)
         return groups
 
+    def is_effective_member(self, user, group):
+        """
+        Check if user is member of a group or of any of its subgroups.
+        """
+        groups = self.get_user_groups(user, effective=True)
+        return any(effective_group.pk == group.pk for effective_group in groups)
+
+    @transaction.atomic
+    def set_parent(self, user, group, parent):
+        """
+        Move a group, with all its subgroups, under a new parent
+        group or to the top level when 'parent' is None. The user
+        must be allowed to edit the group and the new parent. The
+        closure table is updated incrementally and the groups
+        cache of every member of the moved subtree is busted.
+        """
+        for edited in (group, parent):
+            if edited is not None and not has_group_permission(user, edited, 'edit_group'):
+                raise GroupAdministratorError('User cannot edit this group.')
+        self.closure.move_node(group, parent)
+        group.parent = parent
+        group.save(update_fields=['parent'])
+        subtree = self.closure.filter(ancestor=group).values('descendant')
+        member_model = self.model._meta.get_field('members').related_model
+        members = member_model.objects.filter(groupmembership__group__in=subtree) \
+                                      .distinct().values_list('pk', flat=True)
+        cache_bust([('groups', pk) for pk in members])
+        return group
+
     def count_user_groups(self, user):
         """
         Count all groups the user belongs to.
         """
-        count = self.get_user_groups(user).count()
+        count = len(self.get_user_groups(user))
         return count
 
+    def prefill_cache(self, user_pks):
+        """
+        Build the groups cache values for several users
+        with a single query. Return a dictionary of cache
+        keys and values ready to be stored.
+        """
+        values = {make_key('groups', pk): [] for pk in user_pks}
+        groups = self.filter(groupmembership__member__pk__in=user_pks) \
+                     .annotate(member_pk=F('groupmembership__member')) \
+                     .order_by('-groupmembership__date_joined')
+        for group in groups:
+            values[make_key('groups', group.member_pk)].append(group)
+        return {key: pack_instances(groups, GROUP_CACHE_FIELDS) for key, groups in values.items()}
+
+
+class GroupClosureManager(models.Manager):
+    """
+    GroupClosure model manager.
+    The closure table holds one row for every pair of a group and
+    each of its ancestors, including the group itself at depth 0.
+    """
+
+    def add_node(self, group):
+        """
+        Insert the closure rows of a new group: itself and,
+        when it has a parent, every ancestor of the parent.
+        """
+        links = [self.model(ancestor_id=group.pk, descendant_id=group.pk, depth=0)]
+        if group.parent_id:
+            ancestors = self.filter(descendant_id=group.parent_id).values_list('ancestor', 'depth')
+            links += [self.model(ancestor_id=ancestor, descendant_id=group.pk, depth=depth + 1)
+                      for ancestor, depth in ancestors]
+        return self.bulk_create(links)
+
+    def move_node(self, group, parent):
+        """
+        Reattach the subtree of a group under a new parent.
+        Links from the subtree to its former ancestors are
+        deleted and links to the new ancestors inserted.
+        """
+        subtree = list(self.filter(ancestor=group).values_list('descendant', 'depth'))
+        subtree_pks = [descendant for descendant, depth in subtree]
+        if parent is not None and parent.pk in subtree_pks:
+            raise GroupError('A group cannot be moved under itself or one of its subgroups.')
+        self.filter(descendant__in=subtree_pks).exclude(ancestor__in=subtree_pks).delete()
+        if parent is not None:
+            ancestors = list(self.filter(descendant=parent).values_list('ancestor', 'depth'))
+            links = [self.model(ancestor_id=ancestor, descendant_id=descendant, depth=ancestor_depth + depth + 1)
+                     for ancestor, ancestor_depth in ancestors
+                     for descendant, depth in subtree]
+            self.bulk_create(links)
+
+    def rebuild(self):
+        """
+        Rebuild the whole closure table from the group parents.
+        """
+        group_model = self.model._meta.get_field('ancestor').related_model
+        parents = dict(group_model.objects.values_list('pk', 'parent'))
+        links = []
+        for pk in parents:
+            ancestor, depth = pk, 0
+            while ancestor is not None:
+                links.append(self.model(ancestor_id=ancestor, descendant_id=pk, depth=depth))
+                ancestor, depth = parents.get(ancestor), depth + 1
+        with transaction.atomic():
+            self.all().delete()
+            self.bulk_create(links)
+        return len(links)
+
 
 class GroupMembershipManager(models.Manager):
     """
     GroupMembership model manager.
     """
 
+    @property
+    def user_model(self):
+        """
+        Return the model of group members.
+        """
+        return self.model._meta.get_field('member').related_model
+
     def add_membership(self, user, group, permit='PART'):
         """
         New group membership.
@@ -65,8 +205,8 @@ class GroupMembershipManager(models.Manager):
         if group.access == 'PUBLIC':
             membership, created = self.get_or_create(member=user, group=group, permit=permit)
             if created:
-                membership_created.send(sender=self.model)
-                cache_bust([('groups', user.pk), ('memberships', group.pk)])
+                membership_created.send(sender=self.model, user=user, group=group)
+                cache_bust([('groups', user.pk), ('requests', user.pk), ('memberships', group.pk)])
                 return reverse('group:group_detail', kwargs={'group_id': group.pk})
             else:
                 raise GroupMembershipError('Error creating group membership.')
@@ -80,9 +220,10 @@ class GroupMembershipManager(models.Manager):
         Set the creator of a group as administrator.
         There can only be one administrator in each group.
         """
-        if isinstance(group, self.model.__class__):
+        if isinstance(group, self.model.group.field.related_model):
             if not self.filter(group=group, permit=permit).exists():
-                administrator = self.create(member=user, group=group, permit=permit)
+                administrator = self.create(member=user, group=group, permit=permit, roles=ROLE_OWNER)
+                membership_created.send(sender=self.model, user=user, group=group)
                 return administrator
             else:
                 raise GroupError('The group already has one administrator.')
@@ -92,56 +233,191 @@ class GroupMembershipManager(models.Manager):
         """
         Return group administrator.
         """
-        if isinstance(group, self.model.__class__):
+        if isinstance(group, self.model.group.field.related_model):
             try:
-                membership = self.selected_related('member').get(group=group, permit='ADMIN')
+                membership = self.select_related('member').get(group=group, permit='ADMIN')
                 administrator = membership.member
                 return administrator
             except self.model.DoesNotExist:
                 raise GroupError('Group has no administrator.')
         return False
 
+    def with_role(self, group, role):
+        """
+        Return the group memberships holding a role.
+        """
+        bit = get_role_bit(role)
+        return self.filter(group=group).annotate(role=F('roles').bitand(bit)).filter(role=bit)
+
+    def grant_role(self, user, group, role, granted_by):
+        """
+        Add a role to the membership of a user in a group.
+        Only members allowed to manage roles can grant them
+        and the owner role cannot be granted.
+        """
+        if not has_group_permission(granted_by, group, 'manage_roles'):
+            raise GroupAdministratorError('User cannot manage roles in this group.')
+        bit = get_role_bit(role)
+        if bit == ROLE_OWNER:
+            raise GroupError('The group owner role cannot be granted.')
+        updated = self.filter(member=user, group=group).update(roles=F('roles').bitor(bit))
+        if not updated:
+            raise GroupMembershipError('User is not member of this group.')
+        cache_bust([('memberships', group.pk), ('requests', user.pk)])
+        return True
+
+    def revoke_role(self, user, group, role, revoked_by):
+        """
+        Remove a role from the membership of a user in a group.
+        Only members allowed to manage roles can revoke them
+        and the owner role cannot be revoked.
+        """
+        if not has_group_permission(revoked_by, group, 'manage_roles'):
+            raise GroupAdministratorError('User cannot manage roles in this group.')
+        bit = get_role_bit(role)
+        if bit == ROLE_OWNER:
+            raise GroupError('The group owner role cannot be revoked.')
+        updated = self.filter(member=user, group=group).update(roles=F('roles').bitand(~bit))
+        if not updated:
+            raise GroupMembershipError('User is not member of this group.')
+        cache_bust([('memberships', group.pk), ('requests', user.pk)])
+        return True
+
     def memberships(self, group):
         """
         Return all group memberships and members.
         """
         keys = make_key_many([('memberships', group.pk), ('members', group.pk)])
-        memberships = cache.get(keys.get('memberships'))
-        members = cache.get(keys.get('members'))
-        if memberships is None:
-            memberships = self.selected_related('member').filter(group=group)
-            cache.set(keys.get('memberships'), memberships)
-        if members is None:
+        memberships = get_instances(keys.get('memberships'), self.model, MEMBERSHIP_CACHE_FIELDS, using=self.db)
+        members = get_instances(keys.get('members'), self.user_model, MEMBER_CACHE_FIELDS, using=self.db)
+        if memberships is None or members is None:
+            memberships = list(self.select_related('member').filter(group=group))
             members = [membership.member for membership in memberships]
-            cache.set(keys.get('members'), members)
+            cache_set_many({
+                keys.get('memberships'): pack_instances(memberships, MEMBERSHIP_CACHE_FIELDS),
+                keys.get('members'): pack_instances(members, MEMBER_CACHE_FIELDS),
+            })
+        else:
+            members_by_pk = {member.pk: member for member in members}
+            for membership in memberships:
+                if membership.member_id in members_by_pk:
+                    membership.member = members_by_pk[membership.member_id]
         return memberships, members
 
+    def sync_members(self, group, desired_user_ids, batch_size=1000):
+        """
+        Synchronize group participants with an external list of user pks.
+        The difference is computed merging the sorted current member pks,
+        streamed from the database, with the sorted desired pks. Inserts
+        and deletes are applied in batches, one transaction per batch.
+        Removed memberships are archived with the 'REMOVED' outcome when
+        the GROUP_ARCHIVE_ON_DELETE setting is enabled.
+        The group administrator membership is always preserved.
+        Caches are busted once for the group and all affected users.
+        Return a tuple with the number of added and removed members.
+        """
+        desired = sorted(set(desired_user_ids))
+        admins = set(self.filter(group=group, permit='ADMIN').values_list('member', flat=True))
+        current = self.filter(group=group).exclude(permit='ADMIN') \
+                      .order_by('member').values_list('member', flat=True).iterator()
+        to_add, to_remove = _diff_sorted(current, desired)
+        to_add = [pk for pk in to_add if pk not in admins]
+        added = 0
+        for start in range(0, len(to_add), batch_size):
+            chunk = to_add[start:start + batch_size]
+            existing = list(self.user_model.objects.filter(pk__in=chunk).values_list('pk', flat=True))
+            with transaction.atomic():
+                memberships = [self.model(member_id=pk, group=group, permit='PART') for pk in existing]
+                self.bulk_create(memberships)
+                membership_synced.send(sender=self.model, group=group, added=existing, removed=[])
+            added += len(memberships)
+        removed = 0
+        for start in range(0, len(to_remove), batch_size):
+            chunk = to_remove[start:start + batch_size]
+            with transaction.atomic():
+                memberships = self.filter(group=group, member__pk__in=chunk).exclude(permit='ADMIN')
+                if getattr(settings, 'GROUP_ARCHIVE_ON_DELETE', False):
+                    from apps.group.models import ArchivedGroupMembership
+                    deleted = ArchivedGroupMembership.objects.archive(
+                        memberships, batch_size=batch_size, outcome=ArchivedGroupMembership.REMOVED)
+                else:
+                    deleted, rows = memberships.delete()
+                membership_synced.send(sender=self.model, group=group, added=[], removed=chunk)
+            removed += deleted
+        if added or removed:
+            affected = [('groups', pk) for pk in to_add + to_remove] + [('requests', pk) for pk in to_remove]
+            cache_bust([('memberships', group.pk)] + affected)
+        return added, removed
+
     def count_group_members(self, group):
         """
         Count all members belonging to one group.
         """
         memberships, members = self.memberships(group)
-        count = memberships.count()
+        count = len(memberships)
         return count
 
+    def prefill_cache(self, group_pks):
+        """
+        Build the memberships and members cache values for
+        several groups with a single query. Return a dictionary
+        of cache keys and values ready to be stored.
+        """
+        values = {}
+        for pk in group_pks:
+            values[make_key('memberships', pk)] = []
+            values[make_key('members', pk)] = []
+        for membership in self.select_related('member').filter(group__pk__in=group_pks):
+            values[make_key('memberships', membership.group_id)].append(membership)
+            values[make_key('members', membership.group_id)].append(membership.member)
+        for pk in group_pks:
+            memberships_key, members_key = make_key('memberships', pk), make_key('members', pk)
+            values[memberships_key] = pack_instances(values[memberships_key], MEMBERSHIP_CACHE_FIELDS)
+            values[members_key] = pack_instances(values[members_key], MEMBER_CACHE_FIELDS)
+        return values
+
     def is_member(self, user, group):
         """
         Check if user is a group member.
+        The cached member list is not used: decoding it grows
+        with the group size while the query is an index lookup.
         """
-        if user.is_authenticated() and isinstance(group, self.model.__class__):
-            key = make_key('members', group.pk)
-            members = cache.get(key)
-            if members is not None and user in members:
-                return True
-            else:
-                try:
-                    member = self.get(member=user, group=group)
-                    return True
-                except self.model.DoesNotExist:
-                    return False
+        if user.is_authenticated() and isinstance(group, self.model.group.field.related_model):
+            return self.filter(member=user, group=group).exists()
         return False
 
 
+def _diff_sorted(current, desired):
+    """
+    Merge two ascending sequences of pks and return
+    the lists of pks to add and to remove so that
+    'current' becomes equal to 'desired'.
+    """
+    to_add, to_remove = [], []
+    desired = iter(desired)
+    wanted = next(desired, None)
+    for pk in current:
+        while wanted is not None and wanted < pk:
+            to_add.append(wanted)
+            wanted = next(desired, None)
+        if wanted == pk:
+            wanted = next(desired, None)
+        else:
+            to_remove.append(pk)
+    while wanted is not None:
+        to_add.append(wanted)
+        wanted = next(desired, None)
+    return to_add, to_remove
+
+
+def get_inbox_cache_types(groups):
+    """
+    Return the cache types of the membership request inbox of
+    every user allowed to manage the requests of some groups.
+    """
+    return [('requests', pk) for pk in get_permitted_users(groups, 'manage_requests')]
+
+
 class GroupMembershipRequestManager(models.Manager):
     """
     GroupMembership model manager.
@@ -154,32 +430,59 @@ class GroupMembershipRequestManager(models.Manager):
         membership request form if the group is private once checked the
         user is not already a group member.
         The membership request form saving executes this method.
-        """
-        if user.is_authenticated():
-            request, created = self.get_or_create(from_user=from_user, to_administrator=to_admin, group=group, message=message)
+        Only one pending (not rejected) request per user and group is
+        allowed, whatever its message, enforced by a partial unique
+        index on pending requests, and both the sender and the
+        administrator are throttled. The membership_request_sent signal
+        is not sent when GROUP_MEMBERSHIP_REQUEST_NOTIFY is 'digest':
+        administrators are then notified by the digests.
+        """
+        if from_user.is_authenticated():
+            if not allow_membership_request(from_user, to_admin):
+                raise RequestThrottledError('Too many membership requests. Try again later.')
+            try:
+                with transaction.atomic():
+                    request, created = self.get_or_create(
+                        from_user=from_user, group=group, rejected__isnull=True,
+                        defaults={'to_administrator': to_admin, 'message': message})
+            except IntegrityError:
+                created = False
             if not created:
                 raise SendRequestError('Membership request for this group has already been sent.')
-            cache_bust([('requests', to_admin.pk), ('sent_requests', from_user.pk)])
-            membership_request_sent.send(sender=self.model.__class__)
+            cache_bust(get_inbox_cache_types([group]) + [('sent_requests', from_user.pk)])
+            if getattr(settings, 'GROUP_MEMBERSHIP_REQUEST_NOTIFY', 'signal') == 'signal':
+                membership_request_sent.send(sender=self.model, user=from_user, request=request)
             return request
         return False
 
+    def inbox(self, user):
+        """
+        Return the membership requests of the groups where the roles
+        of the user grant the 'manage_requests' permission: the groups
+        they own or moderate. The groups of the user and their role
+        tables are read from the cache.
+        """
+        group_model = self.model._meta.get_field('group').related_model
+        groups = group_model.objects.get_user_groups(user)
+        allowed = has_group_permissions(user, groups, 'manage_requests')
+        return self.filter(group__pk__in=[pk for pk, granted in allowed.items() if granted])
+
     def requests(self, user):
         """
         Return all membership requests.
         """
         key = make_key('requests', user.pk)
-        requests = cache.get(key)
+        requests = get_instances(key, self.model, REQUEST_CACHE_FIELDS, using=self.db)
         if requests is None:
-            requests = self.filter(from_user=user)
-            cache.set(key, requests)
+            requests = list(self.inbox(user))
+            set_instances(key, requests, REQUEST_CACHE_FIELDS)
         return requests
 
     def request_count(self, user):
         """
         Return all membership requests count.
         """
-        count = self.requests(user).count()
+        count = len(self.requests(user))
         return count
 
     def rejected_requests(self, user):
@@ -187,17 +490,17 @@ class GroupMembershipRequestManager(models.Manager):
         Return all rejected membership requests.
         """
         key = make_key('rejected_requests', user.pk)
-        rejected_requests = cache.get(key)
+        rejected_requests = get_instances(key, self.model, REQUEST_CACHE_FIELDS, using=self.db)
         if rejected_requests is None:
-            rejected_requests = self.filter(Q(rejected__isnull=False) | Q(rejected=True), from_user=user)
-            cache.set(key, rejected_requests)
+            rejected_requests = list(self.inbox(user).filter(rejected__isnull=False))
+            set_instances(key, rejected_requests, REQUEST_CACHE_FIELDS)
         return rejected_requests
 
     def rejected_requests_count(self, user):
         """
         Return all rejected membership requests count.
         """
-        count = self.rejected_requests(user).count()
+        count = len(self.rejected_requests(user))
         return count
 
     def unrejected_requests(self, user):
@@ -205,17 +508,17 @@ class GroupMembershipRequestManager(models.Manager):
         Return all unrejected membership requests.
         """
         key = make_key('unrejected_requests', user.pk)
-        unrejected_requests = cache.get(key)
+        unrejected_requests = get_instances(key, self.model, REQUEST_CACHE_FIELDS, using=self.db)
         if unrejected_requests is None:
-            unrejected_requests = self.filter(Q(rejected__isnull=True) | Q(rejected=False), from_user=user)
-            cache.set(key, unrejected_requests)
+            unrejected_requests = list(self.inbox(user).filter(rejected__isnull=True))
+            set_instances(key, unrejected_requests, REQUEST_CACHE_FIELDS)
         return unrejected_requests
 
     def unrejected_requests_count(self, user):
         """
         Return all unrejected membership requests count.
         """
-        count = self.unrejected_requests(user).count()
+        count = len(self.unrejected_requests(user))
         return count
 
     def viewed_requests(self, user):
@@ -223,17 +526,17 @@ class GroupMembershipRequestManager(models.Manager):
         Return all viewed membership requests.
         """
         key = make_key('viewed_requests', user.pk)
-        viewed_requests = cache.get(key)
+        viewed_requests = get_instances(key, self.model, REQUEST_CACHE_FIELDS, using=self.db)
         if viewed_requests is None:
-            viewed_requests = self.filter(Q(viewed__isnull=False) | Q(viewed=True), from_user=user)
-            cache.set(key, viewed_requests)
+            viewed_requests = list(self.inbox(user).filter(viewed__isnull=False))
+            set_instances(key, viewed_requests, REQUEST_CACHE_FIELDS)
         return viewed_requests
 
     def viewed_request_count(self, user):
         """
         Return all viewed membership requests count.
         """
-        count = self.viewed_requests(user).count()
+        count = len(self.viewed_requests(user))
         return count
 
     def unviewed_requests(self, user):
@@ -241,15 +544,251 @@ class GroupMembershipRequestManager(models.Manager):
         Return all unviewed membership requests.
         """
         key = make_key('unviewed_requests', user.pk)
-        unviewed_requests = cache.get(key)
+        unviewed_requests = get_instances(key, self.model, REQUEST_CACHE_FIELDS, using=self.db)
         if unviewed_requests is None:
-            unviewed_requests = self.filter(Q(viewed__isnull=True) | Q(viewed=False), from_user=user)
-            cache.set(key, unviewed_requests)
+            unviewed_requests = list(self.inbox(user).filter(viewed__isnull=True))
+            set_instances(key, unviewed_requests, REQUEST_CACHE_FIELDS)
         return unviewed_requests
 
     def unviewed_request_count(self, user):
         """
         Return all unviewed membership requests count.
         """
-        count = self.unviewed_requests(user).count()
+        count = len(self.unviewed_requests(user))
         return count
+
+    def mark_viewed_requests(self, user, requests):
+        """
+        Mark several membership requests as viewed at once.
+        The permission to manage the requests of all their groups
+        is checked together, so a bulk run over the inbox costs
+        the same number of queries whatever its size.
+        Return the number of requests marked as viewed.
+        """
+        requests = [request for request in requests if not request.viewed]
+        allowed = has_group_permissions(user, [request.group_id for request in requests], 'manage_requests')
+        pks = [request.pk for request in requests if allowed[request.group_id]]
+        if not pks:
+            return 0
+        with transaction.atomic():
+            requests = list(self.select_related('from_user').filter(pk__in=pks, viewed__isnull=True))
+            viewed = timezone.now()
+            self.filter(pk__in=[request.pk for request in requests]).update(viewed=viewed)
+            for request in requests:
+                request.viewed = viewed
+                membership_request_viewed.send(sender=self.model, user=request.from_user, request=request)
+            cache_bust(get_inbox_cache_types(set(request.group_id for request in requests)))
+        return len(requests)
+
+    def prefill_cache(self, user_pks):
+        """
+        Build the membership request inbox cache values for several
+        users with one query for the groups whose requests they are
+        allowed to manage and one for the requests of these groups.
+        Return a dictionary of cache keys and values ready to be stored.
+        """
+        key_types = ['requests', 'rejected_requests', 'unrejected_requests',
+                     'viewed_requests', 'unviewed_requests']
+        values = {make_key(key_type, pk): [] for pk in user_pks for key_type in key_types}
+        membership_model = self.model._meta.get_field('group').related_model.members.through
+        memberships = membership_model.objects.filter(member__pk__in=user_pks) \
+            .annotate(granting=F('roles').bitand(get_permission_roles('manage_requests'))).exclude(granting=0)
+        managers = {}
+        for group, member in memberships.values_list('group', 'member'):
+            managers.setdefault(group, []).append(member)
+        for request in self.filter(group__pk__in=list(managers)):
+            rejected = 'rejected_requests' if request.rejected else 'unrejected_requests'
+            viewed = 'viewed_requests' if request.viewed else 'unviewed_requests'
+            for pk in managers[request.group_id]:
+                for key_type in ('requests', rejected, viewed):
+                    values[make_key(key_type, pk)].append(request)
+        return {key: pack_instances(requests, REQUEST_CACHE_FIELDS) for key, requests in values.items()}
+
+
+class GroupMembershipEventManager(models.Manager):
+    """
+    GroupMembershipEvent model manager.
+    """
+
+    def partition(self, when):
+        """
+        Return the monthly partition number (YYYYMM) of a datetime.
+        """
+        return when.year * 100 + when.month
+
+    def log(self, group, user, event):
+        """
+        Append one membership event to the activity feed.
+        """
+        created = timezone.now()
+        return self.create(group_id=group.pk, user_id=user.pk, event=event,
+                           created=created, partition=self.partition(created))
+
+    def log_many(self, group, user_pks, event):
+        """
+        Append the same membership event for several users
+        to the activity feed with bulk inserts, batched by
+        the database backend.
+        """
+        created = timezone.now()
+        partition = self.partition(created)
+        events = [self.model(group_id=group.pk, user_id=pk, event=event, created=created, partition=partition)
+                  for pk in user_pks]
+        return self.bulk_create(events)
+
+    def feed(self, events, cursor=None, limit=50):
+        """
+        Return one page of events, newest first, and the cursor
+        to request the next page (None when there are no more).
+        The cursor is the pk of the last event returned, so pages
+        are read through the index without offsets. One extra event
+        is read to know whether there is a next page.
+        """
+        if cursor is not None:
+            events = events.filter(pk__lt=cursor)
+        events = list(events.order_by('-pk')[:limit + 1])
+        next_cursor = events[limit - 1].pk if len(events) > limit else None
+        return events[:limit], next_cursor
+
+    def group_feed(self, group, cursor=None, limit=50):
+        """
+        Return the membership activity of a group.
+        """
+        events = self.select_related('user').filter(group_id=group.pk)
+        return self.feed(events, cursor=cursor, limit=limit)
+
+    def user_feed(self, user, cursor=None, limit=50):
+        """
+        Return the membership activity of a user.
+        """
+        events = self.select_related('group').filter(user_id=user.pk)
+        return self.feed(events, cursor=cursor, limit=limit)
+
+    def prune(self, before, batch_size=1000):
+        """
+        Delete the events of every monthly partition older than
+        the 'before' datetime, in batches of 'batch_size' rows.
+        Return the number of deleted events.
+        """
+        events = self.filter(partition__lt=self.partition(before))
+        deleted = 0
+        while True:
+            pks = list(events.values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                return deleted
+            with transaction.atomic():
+                count, rows = self.filter(pk__in=pks).delete()
+            deleted += count
+
+
+class ArchiveManager(models.Manager):
+    """
+    Base manager of the archive models. Live rows are moved
+    to the archive table in batches, one transaction per batch.
+    Subclasses set the field holding the user of the archived row
+    and the caches to bust when a live row is archived.
+    """
+    user_field = None
+
+    def cache_types(self, instances):
+        """
+        Return the cache types busted when live instances are archived.
+        """
+        return []
+
+    def from_live(self, instance, archived, outcome):
+        """
+        Build the archived copy of a live instance.
+        """
+        values = {field: getattr(instance, field) for field in self.model.ARCHIVED_FIELDS}
+        return self.model(original_id=instance.pk, archived=archived, outcome=outcome, **values)
+
+    def archive(self, queryset, batch_size=1000, outcome=''):
+        """
+        Move the rows of a live queryset to the archive, all
+        recorded with the same outcome.
+        Return the number of archived rows.
+        """
+        archived = 0
+        while True:
+            with transaction.atomic():
+                instances = list(queryset.order_by('pk')[:batch_size])
+                if not instances:
+                    return archived
+                now = timezone.now()
+                self.bulk_create([self.from_live(instance, now, outcome) for instance in instances])
+                queryset.model._base_manager.filter(pk__in=[instance.pk for instance in instances]).delete()
+                cache_bust(self.cache_types(instances))
+            archived += len(instances)
+
+    def group_history(self, group):
+        """
+        Return the archived rows of a group, newest first.
+        """
+        return self.filter(group_id=group.pk).order_by('-archived')
+
+    def user_history(self, user):
+        """
+        Return the archived rows of a user, newest first.
+        """
+        return self.filter(**{self.user_field: user.pk}).order_by('-archived')
+
+
+class ArchivedGroupMembershipManager(ArchiveManager):
+    """
+    ArchivedGroupMembership model manager.
+    """
+    user_field = 'member_id'
+
+    def cache_types(self, instances):
+        """
+        Archiving a membership changes the member groups, the requests
+        the member manages and the group members.
+        """
+        return [cache_type for instance in instances
+                for cache_type in (('groups', instance.member_id), ('requests', instance.member_id),
+                                   ('memberships', instance.group_id))]
+
+
+class ArchivedGroupMembershipRequestManager(ArchiveManager):
+    """
+    ArchivedGroupMembershipRequest model manager.
+    """
+    user_field = 'from_user_id'
+
+    def cache_types(self, instances):
+        """
+        Archiving requests changes the inbox of the users managing
+        the requests of their groups and the sent requests.
+        """
+        groups = set(instance.group_id for instance in instances)
+        return get_inbox_cache_types(groups) + [('sent_requests', instance.from_user_id) for instance in instances]
+
+
+class GroupMembershipDigestManager(models.Manager):
+    """
+    GroupMembershipDigest model manager.
+    """
+
+    def claim(self):
+        """
+        Record a digest run and mark the pending requests, unviewed
+        and unrejected, not covered by a previous run as covered by
+        it. Only unmarked requests are marked, so concurrent runs
+        cover disjoint requests and requests committed after a run
+        are covered by the next one. Return the run.
+        """
+        request_model = self.model._meta.get_field('requests').related_model
+        with transaction.atomic():
+            digest_run = self.create()
+            request_model.objects.filter(digest__isnull=True, viewed__isnull=True, rejected__isnull=True) \
+                                 .update(digest=digest_run)
+        return digest_run
+
+    def release(self, digest_run, delivered_pks):
+        """
+        Unmark the requests of a run not included in any delivered
+        digest, so the next run covers them again.
+        Return the number of released requests.
+        """
+        return digest_run.requests.exclude(pk__in=delivered_pks).update(digest=None)
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 12:36
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('group', '0002_membership_request_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GroupMembershipEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event', models.PositiveSmallIntegerField(choices=[(1, 'Joined'), (2, 'Left'), (3, 'Request accepted'), (4, 'Request rejected')], verbose_name='Event')),
+                ('created', models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='Created')),
+                ('partition', models.PositiveIntegerField(db_index=True, editable=False, verbose_name='Partition')),
+                ('group', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='group.Group')),
+                ('user', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Membership Event',
+                'verbose_name_plural': 'Membership Events',
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='groupmembershipevent',
+            index_together=set([('user', 'id'), ('group', 'id')]),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 12:41
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_closure_links(apps, schema_editor):
+    """
+    Every existing group is a top level group,
+    linked only to itself in the closure table.
+    """
+    Group = apps.get_model('group', 'Group')
+    GroupClosure = apps.get_model('group', 'GroupClosure')
+    links = [GroupClosure(ancestor_id=pk, descendant_id=pk, depth=0)
+             for pk in Group.objects.values_list('pk', flat=True)]
+    GroupClosure.objects.bulk_create(links)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('group', '0003_membership_event'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GroupClosure',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveIntegerField(verbose_name='Depth')),
+            ],
+            options={
+                'verbose_name': 'Group Closure',
+                'verbose_name_plural': 'Group Closures',
+            },
+        ),
+        migrations.AddField(
+            model_name='group',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='subgroups', to='group.Group'),
+        ),
+        migrations.AddField(
+            model_name='groupclosure',
+            name='ancestor',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to='group.Group'),
+        ),
+        migrations.AddField(
+            model_name='groupclosure',
+            name='descendant',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to='group.Group'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='groupclosure',
+            unique_together=set([('ancestor', 'descendant')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='groupclosure',
+            index_together=set([('descendant', 'ancestor')]),
+        ),
+        migrations.RunPython(create_closure_links, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 12:42
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+# Role bits at the time of this migration.
+ROLE_OWNER = 1
+ROLE_PARTICIPANT = 4
+
+
+def set_administrator_roles(apps, schema_editor):
+    """
+    Existing group administrators become group owners.
+    Participants already get the participant role default.
+    """
+    GroupMembership = apps.get_model('group', 'GroupMembership')
+    GroupMembership.objects.filter(permit='ADMIN').update(roles=ROLE_OWNER)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('group', '0004_group_hierarchy'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='groupmembership',
+            name='roles',
+            field=models.PositiveIntegerField(default=4, help_text='Bitmask of the member roles in the group.', verbose_name='Roles'),
+        ),
+        migrations.AlterIndexTogether(
+            name='groupmembership',
+            index_together=set([('group', 'roles')]),
+        ),
+        migrations.RunPython(set_administrator_roles, migrations.RunPython.noop),
+    ]
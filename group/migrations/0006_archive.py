@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 12:42
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('group', '0005_membership_roles'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedGroupMembership',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('original_id', models.PositiveIntegerField(verbose_name='Original id')),
+                ('permit', models.CharField(choices=[('ADMIN', 'Administrator'), ('PART', 'Participant')], max_length=5, verbose_name='Permit')),
+                ('roles', models.PositiveIntegerField(verbose_name='Roles')),
+                ('date_joined', models.DateField(verbose_name='Date')),
+                ('archived', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Archived')),
+                ('group', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='group.Group')),
+                ('member', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Archived Membership',
+                'verbose_name_plural': 'Archived Memberships',
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedGroupMembershipRequest',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('original_id', models.PositiveIntegerField(verbose_name='Original id')),
+                ('message', models.TextField(blank=True, max_length=150, verbose_name='Message')),
+                ('created', models.DateTimeField(verbose_name='Created')),
+                ('rejected', models.DateTimeField(blank=True, null=True, verbose_name='Rejected')),
+                ('viewed', models.DateTimeField(blank=True, null=True, verbose_name='Viewed')),
+                ('archived', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Archived')),
+                ('from_user', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('group', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='group.Group')),
+                ('to_administrator', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Archived Membership Request',
+                'verbose_name_plural': 'Archived Membership Requests',
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='archivedgroupmembershiprequest',
+            index_together=set([('from_user', 'archived'), ('group', 'archived')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='archivedgroupmembership',
+            index_together=set([('group', 'archived'), ('member', 'archived')]),
+        ),
+    ]
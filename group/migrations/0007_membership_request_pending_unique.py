@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.models import Count
+from django.utils import timezone
+
+
+def reject_duplicate_requests(apps, schema_editor):
+    """
+    Keep only the newest pending request of each user and group.
+    Older duplicates are marked as rejected so the unique index
+    on pending requests can be created.
+    """
+    GroupMembershipRequest = apps.get_model('group', 'GroupMembershipRequest')
+    pending = GroupMembershipRequest.objects.filter(rejected__isnull=True)
+    duplicates = pending.values('from_user', 'group').annotate(count=Count('pk')).filter(count__gt=1)
+    now = timezone.now()
+    for duplicate in duplicates:
+        requests = pending.filter(from_user=duplicate['from_user'], group=duplicate['group']).order_by('-pk')
+        older = list(requests.values_list('pk', flat=True)[1:])
+        GroupMembershipRequest.objects.filter(pk__in=older).update(rejected=now)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('group', '0006_archive'),
+    ]
+
+    operations = [
+        migrations.RunPython(reject_duplicate_requests, migrations.RunPython.noop),
+        # Partial index, supported by PostgreSQL and SQLite.
+        migrations.RunSQL(
+            ['CREATE UNIQUE INDEX group_groupmembershiprequest_pending_uniq '
+             'ON group_groupmembershiprequest (from_user_id, group_id) WHERE rejected IS NULL'],
+            ['DROP INDEX group_groupmembershiprequest_pending_uniq'],
+        ),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 13:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def set_rejected_outcome(apps, schema_editor):
+    """
+    Requests archived before outcomes were recorded are
+    only known to be rejected when they have a rejection date.
+    """
+    ArchivedGroupMembershipRequest = apps.get_model('group', 'ArchivedGroupMembershipRequest')
+    ArchivedGroupMembershipRequest.objects.filter(rejected__isnull=False).update(outcome='REJECTED')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('group', '0007_membership_request_pending_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedgroupmembership',
+            name='outcome',
+            field=models.CharField(blank=True, choices=[('LEFT', 'Left'), ('REMOVED', 'Removed'), ('INACTIVE', 'Inactive member')], max_length=9, verbose_name='Outcome'),
+        ),
+        migrations.AddField(
+            model_name='archivedgroupmembershiprequest',
+            name='outcome',
+            field=models.CharField(blank=True, choices=[('ACCEPTED', 'Accepted'), ('REJECTED', 'Rejected'), ('WITHDRAWN', 'Withdrawn'), ('REMOVED', 'Removed'), ('EXPIRED', 'Expired')], max_length=9, verbose_name='Outcome'),
+        ),
+        migrations.RunPython(set_rejected_outcome, migrations.RunPython.noop),
+    ]
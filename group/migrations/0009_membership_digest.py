@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 13:01
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('group', '0008_archive_outcome'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GroupMembershipDigest',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('since', models.DateTimeField(unique=True, verbose_name='Since')),
+                ('until', models.DateTimeField(verbose_name='Until')),
+                ('delivered', models.PositiveIntegerField(default=0, verbose_name='Delivered')),
+            ],
+            options={
+                'verbose_name': 'Membership Digest',
+                'verbose_name_plural': 'Membership Digests',
+            },
+        ),
+    ]
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def mark_digested_requests(apps, schema_editor):
+    """
+    Runs used to cover the requests created until their end.
+    Mark the requests created before the end of the last run
+    as covered by it so they are not sent again.
+    """
+    GroupMembershipDigest = apps.get_model('group', 'GroupMembershipDigest')
+    GroupMembershipRequest = apps.get_model('group', 'GroupMembershipRequest')
+    for digest_run in GroupMembershipDigest.objects.all():
+        GroupMembershipDigest.objects.filter(pk=digest_run.pk).update(created=digest_run.until)
+    last = GroupMembershipDigest.objects.order_by('-until').first()
+    if last is not None:
+        GroupMembershipRequest.objects.filter(created__lt=last.until).update(digest=last)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('group', '0009_membership_digest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='groupmembershipdigest',
+            name='created',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='Created'),
+        ),
+        migrations.AddField(
+            model_name='groupmembershiprequest',
+            name='digest',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='requests', to='group.GroupMembershipDigest'),
+        ),
+        # SQLite rebuilds the table to add the column, dropping the
+        # partial index on pending requests created by migration 0007.
+        migrations.RunSQL(
+            ['CREATE UNIQUE INDEX IF NOT EXISTS group_groupmembershiprequest_pending_uniq '
+             'ON group_groupmembershiprequest (from_user_id, group_id) WHERE rejected IS NULL'],
+            migrations.RunSQL.noop,
+        ),
+        migrations.RunPython(mark_digested_requests, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='groupmembershipdigest',
+            name='since',
+        ),
+        migrations.RemoveField(
+            model_name='groupmembershipdigest',
+            name='until',
+        ),
+    ]
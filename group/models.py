@@ -1,5 +1,6 @@
 import datetime
 
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.db import models, transaction
 from django.urls import reverse
@@ -8,7 +9,14 @@ from django.utils.translation import ugettext_lazy as _
 
 from apps.group.caches import cache_bust
 from apps.group.decorators import group_admin_permit_required
-from apps.group.managers import GroupManager, GroupMembershipManager, GroupMembershipRequestManager
+from apps.group.permissions import ROLE_OWNER, ROLE_PARTICIPANT, has_group_permission
+from apps.group.managers import (GroupManager, GroupClosureManager, GroupMembershipManager,
+                                 GroupMembershipRequestManager, GroupMembershipEventManager,
+                                 ArchivedGroupMembershipManager, ArchivedGroupMembershipRequestManager,
+                                 GroupMembershipDigestManager, get_inbox_cache_types)
+from apps.group.signals import (group_and_membership_remove, membership_removed,
+                                membership_request_accepted, membership_request_rejected,
+                                membership_request_viewed)
 
 # Create your models here.
 
@@ -23,11 +31,24 @@ PERMIT_TYPES = (
 )
 
 
+def discard(instance, archive_model, outcome):
+    """
+    Delete a membership or membership request. When the
+    GROUP_ARCHIVE_ON_DELETE setting is enabled the row is
+    moved to its archive table instead, with its outcome.
+    """
+    if getattr(settings, 'GROUP_ARCHIVE_ON_DELETE', False):
+        archive_model.objects.archive(instance.__class__._base_manager.filter(pk=instance.pk), outcome=outcome)
+    else:
+        instance.delete()
+
+
 class Group(models.Model):
     """
     Model to define groups.
     Each group can contain any number of members and
     any user can be member of as many groups as desired.
+    Groups can be nested under a parent group.
     """
     name = models.CharField(
         _('Name'),
@@ -49,6 +70,13 @@ class Group(models.Model):
         default=datetime.date.today,
         editable=False,
     )
+    parent = models.ForeignKey(
+        'self',
+        on_delete=models.CASCADE,
+        related_name='subgroups',
+        blank=True,
+        null=True,
+    )
 
     class Meta:
         verbose_name = _('Group')
@@ -71,16 +99,57 @@ class Group(models.Model):
     def remove_group(self, user):
         """
         Remove selected group by its administrator.
+        Its subgroups are removed with it, so the caches of
+        every group in the subtree and of their members are busted.
         """
-        group_pk = self.pk
+        subtree = list(Group.objects.filter(ancestor_links__ancestor=self).values_list('pk', flat=True))
+        members = GroupMembership.objects.filter(group__in=subtree).values_list('member', flat=True).distinct()
+        cache_types = [('memberships', pk) for pk in subtree]
+        cache_types += [(key_type, pk) for pk in members for key_type in ('groups', 'requests')]
         response = group_and_membership_remove.send(sender=self.__class__, user=user, group=self)
         receiver, deleted = response[0]
         if deleted:
-            cache_bust([('groups', user.pk), ('memberships', group_pk)])
+            cache_bust(cache_types)
             return True
         return False
 
 
+class GroupClosure(models.Model):
+    """
+    Model to define the transitive closure of the group
+    hierarchy: one row for each group and each of its
+    ancestors, the group itself included at depth 0.
+    """
+    ancestor = models.ForeignKey(
+        Group,
+        on_delete=models.CASCADE,
+        related_name='descendant_links',
+    )
+    descendant = models.ForeignKey(
+        Group,
+        on_delete=models.CASCADE,
+        related_name='ancestor_links',
+    )
+    depth = models.PositiveIntegerField(
+        _('Depth'),
+    )
+
+    class Meta:
+        verbose_name = _('Group Closure')
+        verbose_name_plural = _('Group Closures')
+        unique_together = [
+            ('ancestor', 'descendant'),
+        ]
+        index_together = [
+            ('descendant', 'ancestor'),
+        ]
+
+    objects = GroupClosureManager()
+
+    def __str__(self):
+        return '{ancestor} is ancestor of {descendant}'.format(ancestor=self.ancestor_id, descendant=self.descendant_id)
+
+
 class GroupMembership(models.Model):
     """
     Model to define each member of a group.
@@ -104,10 +173,18 @@ class GroupMembership(models.Model):
         default=datetime.date.today,
         editable=False,
     )
+    roles = models.PositiveIntegerField(
+        _('Roles'),
+        default=ROLE_PARTICIPANT,
+        help_text=_('Bitmask of the member roles in the group.'),
+    )
 
     class Meta:
         verbose_name = _('Membership')
         verbose_name_plural = _('Memberships')
+        index_together = [
+            ('group', 'roles'),
+        ]
 
     objects = GroupMembershipManager()
 
@@ -118,21 +195,24 @@ class GroupMembership(models.Model):
     def remove_membership(self, user):
         """
         Delete user's membership to a group.
-        User can leave the group or be removed by the
-        group administrator.
-        If the administrator leaves the group the group
-        is deleted.
+        User can leave the group or be removed by a member
+        whose roles grant the 'remove_members' permission.
+        The group owner cannot be removed: if the owner
+        leaves the group the group is deleted.
         """
-        if user.is_authenticated() and self.objects.is_member(user):
-            administrator = self.objects.get_group_admin(self.group)
-            if user == self.member != administrator or user == administrator:
-                group = self.group
-                self.delete()
-                cache_bust([('groups', user.pk), ('memberships', group.pk)])
-                return True
-            elif user == self.member == administrator:
-                response = Group.objects.remove_group(user)
+        if user.is_authenticated() and GroupMembership.objects.is_member(user, self.group):
+            group = self.group
+            is_owner = bool(self.roles & ROLE_OWNER)
+            if user.pk == self.member_id and is_owner:
+                response = group.remove_group(user)
                 return response
+            if user.pk == self.member_id or (not is_owner and has_group_permission(user, group, 'remove_members')):
+                left = user.pk == self.member_id
+                discard(self, ArchivedGroupMembership,
+                        ArchivedGroupMembership.LEFT if left else ArchivedGroupMembership.REMOVED)
+                membership_removed.send(sender=self.__class__, user=self.member, group=group)
+                cache_bust([('groups', self.member_id), ('requests', self.member_id), ('memberships', group.pk)])
+                return True
         return False
 
 
@@ -181,10 +261,21 @@ class GroupMembershipRequest(models.Model):
         null=True,
         editable=True,
     )
+    digest = models.ForeignKey(
+        'GroupMembershipDigest',
+        on_delete=models.SET_NULL,
+        related_name='requests',
+        blank=True,
+        null=True,
+        editable=False,
+    )
 
     class Meta:
         verbose_name = _('Membership Request')
         verbose_name_plural = _('Membership Requests')
+        index_together = [
+            ('from_user', 'group'),
+        ]
 
     objects = GroupMembershipRequestManager()
 
@@ -200,9 +291,9 @@ class GroupMembershipRequest(models.Model):
         """
         membership, created = GroupMembership.objects.get_or_create(member=self.from_user, group=self.group, permit='PART')
         if created:
-            self.remove_membership_request(user)
+            self.remove_membership_request(user, group, outcome=ArchivedGroupMembershipRequest.ACCEPTED)
             membership_request_accepted.send(sender=self.__class__, user=self.from_user, request=self)
-            cache_bust([('memberships', group.pk)])
+            cache_bust([('groups', self.from_user_id), ('requests', self.from_user_id), ('memberships', group.pk)])
             return membership
 
     @group_admin_permit_required
@@ -215,19 +306,19 @@ class GroupMembershipRequest(models.Model):
         if not self.rejected:
             self.rejected = timezone.now()
             self.save()
-            membership_request_rejectd.send(sender=self.__class__, user=self.from_user, request=self)
-            cache_bust([('requests', self.to_administrator.pk)])
+            membership_request_rejected.send(sender=self.__class__, user=self.from_user, request=self)
+            cache_bust(get_inbox_cache_types([self.group_id]))
             return True
 
     @group_admin_permit_required
     @transaction.atomic
-    def remove_membership_request(self, user, group):
+    def remove_membership_request(self, user, group, outcome='REMOVED'):
         """
         The administrator of the group removes
         the request to join the group.
         """
-        self.delete()
-        cache_bust([('requests', self.to_administrator.pk)])
+        discard(self, ArchivedGroupMembershipRequest, outcome)
+        cache_bust(get_inbox_cache_types([self.group_id]))
         return True
 
     @transaction.atomic
@@ -237,7 +328,7 @@ class GroupMembershipRequest(models.Model):
         the request to join the group.
         """
         if user.is_authenticated() and user == self.from_user:
-            self.delete()
+            discard(self, ArchivedGroupMembershipRequest, ArchivedGroupMembershipRequest.WITHDRAWN)
             cache_bust([('sent_requests', user.pk)])
             return True
         return False
@@ -252,9 +343,9 @@ class GroupMembershipRequest(models.Model):
         """
         if not self.viewed:
             self.viewed = timezone.now()
-            self.saved()
+            self.save()
             membership_request_viewed.send(sender=self.__class__, user=self.from_user, request=self)
-            cache_bust([('requests', self.to_administrator.pk)])
+            cache_bust(get_inbox_cache_types([self.group_id]))
             return True
 
     @group_admin_permit_required
@@ -265,7 +356,250 @@ class GroupMembershipRequest(models.Model):
         as viewed the membership request.
         """
         if self.viewed:
-            self.viewed =''
-            self.saved()
-            cache_bust([('requests', self.to_administrator.pk)])
+            self.viewed = None
+            self.save()
+            cache_bust(get_inbox_cache_types([self.group_id]))
             return True
+
+
+class GroupMembershipEvent(models.Model):
+    """
+    Model to define the append-only log of membership
+    activity (joins, leaves and request decisions).
+    Events reference users and groups without database
+    constraints so the log never blocks or cascades deletes,
+    and are bucketed in monthly partitions for pruning.
+    """
+    JOINED = 1
+    LEFT = 2
+    ACCEPTED = 3
+    REJECTED = 4
+
+    EVENT_TYPES = (
+        (JOINED, 'Joined'),
+        (LEFT, 'Left'),
+        (ACCEPTED, 'Request accepted'),
+        (REJECTED, 'Request rejected'),
+    )
+
+    group = models.ForeignKey(
+        Group,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='+',
+    )
+    user = models.ForeignKey(
+        User,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='+',
+    )
+    event = models.PositiveSmallIntegerField(
+        _('Event'),
+        choices=EVENT_TYPES,
+    )
+    created = models.DateTimeField(
+        _('Created'),
+        default=timezone.now,
+        editable=False,
+    )
+    partition = models.PositiveIntegerField(
+        _('Partition'),
+        db_index=True,
+        editable=False,
+    )
+
+    class Meta:
+        verbose_name = _('Membership Event')
+        verbose_name_plural = _('Membership Events')
+        index_together = [
+            ('group', 'id'),
+            ('user', 'id'),
+        ]
+
+    objects = GroupMembershipEventManager()
+
+    def __str__(self):
+        return '{user} {event} {group}'.format(user=self.user_id, event=self.get_event_display(), group=self.group_id)
+
+
+class ArchivedGroupMembership(models.Model):
+    """
+    Model to define the archive of ended group memberships.
+    Archived rows keep the users and groups they refer to
+    without database constraints.
+    """
+    ARCHIVED_FIELDS = ('member_id', 'group_id', 'permit', 'roles', 'date_joined')
+
+    LEFT = 'LEFT'
+    REMOVED = 'REMOVED'
+    INACTIVE = 'INACTIVE'
+
+    OUTCOMES = (
+        (LEFT, 'Left'),
+        (REMOVED, 'Removed'),
+        (INACTIVE, 'Inactive member'),
+    )
+
+    original_id = models.PositiveIntegerField(
+        _('Original id'),
+    )
+    member = models.ForeignKey(
+        User,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='+',
+    )
+    group = models.ForeignKey(
+        Group,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='+',
+    )
+    permit = models.CharField(
+        _('Permit'),
+        max_length=5,
+        choices=PERMIT_TYPES,
+    )
+    roles = models.PositiveIntegerField(
+        _('Roles'),
+    )
+    date_joined = models.DateField(
+        _('Date'),
+    )
+    outcome = models.CharField(
+        _('Outcome'),
+        max_length=9,
+        blank=True,
+        choices=OUTCOMES,
+    )
+    archived = models.DateTimeField(
+        _('Archived'),
+        default=timezone.now,
+    )
+
+    class Meta:
+        verbose_name = _('Archived Membership')
+        verbose_name_plural = _('Archived Memberships')
+        index_together = [
+            ('group', 'archived'),
+            ('member', 'archived'),
+        ]
+
+    objects = ArchivedGroupMembershipManager()
+
+    def __str__(self):
+        return '{user} was member of the group {group}'.format(user=self.member_id, group=self.group_id)
+
+
+class ArchivedGroupMembershipRequest(models.Model):
+    """
+    Model to define the archive of processed or old
+    membership requests. Archived rows keep the users and
+    groups they refer to without database constraints.
+    """
+    ARCHIVED_FIELDS = ('from_user_id', 'to_administrator_id', 'group_id', 'message', 'created', 'rejected', 'viewed')
+
+    ACCEPTED = 'ACCEPTED'
+    REJECTED = 'REJECTED'
+    WITHDRAWN = 'WITHDRAWN'
+    REMOVED = 'REMOVED'
+    EXPIRED = 'EXPIRED'
+
+    OUTCOMES = (
+        (ACCEPTED, 'Accepted'),
+        (REJECTED, 'Rejected'),
+        (WITHDRAWN, 'Withdrawn'),
+        (REMOVED, 'Removed'),
+        (EXPIRED, 'Expired'),
+    )
+
+    original_id = models.PositiveIntegerField(
+        _('Original id'),
+    )
+    from_user = models.ForeignKey(
+        User,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='+',
+    )
+    to_administrator = models.ForeignKey(
+        User,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='+',
+    )
+    group = models.ForeignKey(
+        Group,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='+',
+    )
+    message = models.TextField(
+        _('Message'),
+        max_length=150,
+        blank=True,
+    )
+    created = models.DateTimeField(
+        _('Created'),
+    )
+    rejected = models.DateTimeField(
+        _('Rejected'),
+        blank=True,
+        null=True,
+    )
+    viewed = models.DateTimeField(
+        _('Viewed'),
+        blank=True,
+        null=True,
+    )
+    outcome = models.CharField(
+        _('Outcome'),
+        max_length=9,
+        blank=True,
+        choices=OUTCOMES,
+    )
+    archived = models.DateTimeField(
+        _('Archived'),
+        default=timezone.now,
+    )
+
+    class Meta:
+        verbose_name = _('Archived Membership Request')
+        verbose_name_plural = _('Archived Membership Requests')
+        index_together = [
+            ('group', 'archived'),
+            ('from_user', 'archived'),
+        ]
+
+    objects = ArchivedGroupMembershipRequestManager()
+
+    def __str__(self):
+        return '{user} membership request to {group}'.format(user=self.from_user_id, group=self.group_id)
+
+
+class GroupMembershipDigest(models.Model):
+    """
+    Model to define each run of the membership request digests.
+    A run marks the pending requests not covered by a previous run,
+    so requests committed late and missed or concurrent runs neither
+    drop nor duplicate requests.
+    """
+    created = models.DateTimeField(
+        _('Created'),
+        default=timezone.now,
+        editable=False,
+    )
+    delivered = models.PositiveIntegerField(
+        _('Delivered'),
+        default=0,
+    )
+
+    class Meta:
+        verbose_name = _('Membership Digest')
+        verbose_name_plural = _('Membership Digests')
+
+    objects = GroupMembershipDigestManager()
+
+    def __str__(self):
+        return 'Digests of {created}'.format(created=self.created)
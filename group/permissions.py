@@ -0,0 +1,156 @@
+from django.conf import settings
+from django.db.models import F
+
+from apps.group.caches import cache_get_many, cache_set_many, make_key
+
+# Create your permissions here.
+
+# Group permissions, one bit each.
+PERMISSIONS = {
+    'manage_requests': 1 << 0,
+    'remove_members': 1 << 1,
+    'edit_group': 1 << 2,
+    'remove_group': 1 << 3,
+    'manage_roles': 1 << 4,
+}
+
+# Built-in roles, one bit each in GroupMembership.roles.
+ROLE_OWNER = 1 << 0
+ROLE_MODERATOR = 1 << 1
+ROLE_PARTICIPANT = 1 << 2
+
+# Role name: (role bit, permission names granted).
+ROLES = {
+    'OWNER': (ROLE_OWNER, list(PERMISSIONS)),
+    'MODERATOR': (ROLE_MODERATOR, ['manage_requests', 'remove_members']),
+    'PARTICIPANT': (ROLE_PARTICIPANT, []),
+}
+
+
+def get_group_pk(group):
+    """
+    Return the primary key of a group instance or of a group pk.
+    """
+    return int(getattr(group, 'pk', group))
+
+
+def get_roles():
+    """
+    Return the role definitions. Roles can be added or
+    the permissions of the built-in ones changed with the
+    GROUP_ROLES setting, using the same format as ROLES.
+    """
+    roles = dict(ROLES)
+    roles.update(getattr(settings, 'GROUP_ROLES', {}))
+    return roles
+
+
+def get_role_bit(role):
+    """
+    Return the bit of a role name.
+    """
+    return get_roles()[role][0]
+
+
+def get_granting_roles():
+    """
+    Return the bitmask of the roles granting any permission.
+    """
+    mask = 0
+    for bit, permissions in get_roles().values():
+        if permissions:
+            mask |= bit
+    return mask
+
+
+def get_permission_roles(permission):
+    """
+    Return the bitmask of the roles granting a permission.
+    """
+    mask = 0
+    for bit, permissions in get_roles().values():
+        if permission in permissions:
+            mask |= bit
+    return mask
+
+
+def get_permission_mask(roles):
+    """
+    Return the permissions bitmask granted by a roles bitmask.
+    """
+    mask = 0
+    for bit, permissions in get_roles().values():
+        if roles & bit:
+            for permission in permissions:
+                mask |= PERMISSIONS[permission]
+    return mask
+
+
+def load_role_tables(group_pks):
+    """
+    Build the role table rows of several groups with a single query.
+    Return a dictionary {group_pk: [[user_pk, permissions bitmask]]}.
+    """
+    from apps.group.models import GroupMembership
+    tables = {pk: [] for pk in group_pks}
+    memberships = GroupMembership.objects.filter(group__pk__in=group_pks) \
+                      .annotate(granting=F('roles').bitand(get_granting_roles())).exclude(granting=0)
+    for group, member, roles in memberships.values_list('group', 'member', 'roles'):
+        tables[group].append([member, get_permission_mask(roles)])
+    return tables
+
+
+def get_role_tables(groups):
+    """
+    Return a dictionary {group_pk: {user_pk: permissions bitmask}}
+    with the members of several groups whose roles grant any
+    permission. The tables are cached per group and busted with the
+    group memberships. Cached tables are read with a single get_many
+    and the missing ones loaded with a single query.
+    """
+    keys = {pk: make_key('roles', pk) for pk in set(get_group_pk(group) for group in groups)}
+    cached = cache_get_many(list(keys.values()))
+    tables = {pk: cached[key] for pk, key in keys.items() if key in cached}
+    missing = [pk for pk in keys if pk not in tables]
+    if missing:
+        loaded = load_role_tables(missing)
+        cache_set_many({keys[pk]: rows for pk, rows in loaded.items()})
+        tables.update(loaded)
+    return {pk: dict(rows) for pk, rows in tables.items()}
+
+
+def get_role_table(group):
+    """
+    Return the role table {user_pk: permissions bitmask} of a group.
+    """
+    pk = get_group_pk(group)
+    return get_role_tables([pk])[pk]
+
+
+def has_group_permission(user, group, permission):
+    """
+    Check if the roles of a user in a group grant a permission.
+    """
+    return has_group_permissions(user, [group], permission)[get_group_pk(group)]
+
+
+def has_group_permissions(user, groups, permission):
+    """
+    Check if the roles of a user grant a permission in several
+    groups at once, reading all their role tables together.
+    Return a dictionary {group_pk: bool}.
+    """
+    if not user.is_authenticated():
+        return {get_group_pk(group): False for group in groups}
+    bit = PERMISSIONS[permission]
+    return {pk: bool(table.get(user.pk, 0) & bit) for pk, table in get_role_tables(groups).items()}
+
+
+def get_permitted_users(groups, permission):
+    """
+    Return the pks of the users whose roles grant a permission
+    in any of several groups, read from their role tables.
+    """
+    bit = PERMISSIONS[permission]
+    return sorted(set(pk for table in get_role_tables(groups).values()
+                      for pk, mask in table.items() if mask & bit))
@@ -11,6 +11,7 @@ membership_request_viewed = Signal()
 membership_request_sent = Signal()
 membership_created = Signal()
 membership_removed = Signal()
+membership_synced = Signal(providing_args=['group', 'added', 'removed'])
 
 # Create your receivers here.
 
@@ -27,17 +28,61 @@ def create_group_admin(sender, user, group, *args, **kwargs):
 
 def remove_group_and_memberships(sender, user, group, *args, **kwargs):
     """
-    A group administrator removes the group.
-    Also if an administrator leaves the group then
-    the group itself is deleted.
+    A member whose roles grant the 'remove_group' permission
+    removes the group. Also if the group owner leaves the group
+    then the group itself is deleted.
     """
+    from apps.group.exceptions import GroupError
     from apps.group.models import Group, GroupMembership
-    if user.is_authenticated() and user == GroupMembership.objects.get_group_admin(group):
+    from apps.group.permissions import has_group_permission
+    if has_group_permission(user, group, 'remove_group'):
         try:
-            deleted = Group.objects.get(pk=group.pk).deleted()
+            deleted, rows = Group.objects.get(pk=group.pk).delete()
             if deleted:
                 GroupMembership.objects.filter(group=group).delete()
                 return True
         except Group.DoesNotExist:
             raise GroupError('Group does not exit.')
     return False
+
+
+def log_membership_created(sender, user, group, *args, **kwargs):
+    """
+    Record in the activity feed that a user joined a group.
+    """
+    from apps.group.models import GroupMembershipEvent
+    return GroupMembershipEvent.objects.log(group=group, user=user, event=GroupMembershipEvent.JOINED)
+
+
+def log_membership_removed(sender, user, group, *args, **kwargs):
+    """
+    Record in the activity feed that a user left a group.
+    """
+    from apps.group.models import GroupMembershipEvent
+    return GroupMembershipEvent.objects.log(group=group, user=user, event=GroupMembershipEvent.LEFT)
+
+
+def log_membership_request_accepted(sender, user, request, *args, **kwargs):
+    """
+    Record in the activity feed that a membership request was accepted.
+    """
+    from apps.group.models import GroupMembershipEvent
+    return GroupMembershipEvent.objects.log(group=request.group, user=user, event=GroupMembershipEvent.ACCEPTED)
+
+
+def log_membership_request_rejected(sender, user, request, *args, **kwargs):
+    """
+    Record in the activity feed that a membership request was rejected.
+    """
+    from apps.group.models import GroupMembershipEvent
+    return GroupMembershipEvent.objects.log(group=request.group, user=user, event=GroupMembershipEvent.REJECTED)
+
+
+def log_membership_synced(sender, group, added, removed, *args, **kwargs):
+    """
+    Record in the activity feed the members added and
+    removed by a group synchronization in bulk.
+    """
+    from apps.group.models import GroupMembershipEvent
+    GroupMembershipEvent.objects.log_many(group=group, user_pks=added, event=GroupMembershipEvent.JOINED)
+    GroupMembershipEvent.objects.log_many(group=group, user_pks=removed, event=GroupMembershipEvent.LEFT)
@@ -1,3 +1,809 @@
-from django.test import TestCase
+import datetime
+import io
+import json
+import threading
+import time
+from unittest import mock
+
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, transaction
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from apps.group.api import api_group_detail, api_group_members, api_membership_requests, api_user_groups
+from apps.group.apps import is_management_command
+from apps.group.caches import (CompactCodec, PickleCodec, acquire_warmup_lock, cache_bust, cache_get, cache_set,
+                               cache_set_many, get_codec, make_chunk_keys, make_key, pack_instances,
+                               unpack_instances, warm_cache)
+from apps.group.digests import BaseDigestBackend, send_digests
+from apps.group.exceptions import GroupAdministratorError, GroupError, SendRequestError
+from apps.group.management.commands.group_importtime import Command as ImportTimeCommand
+from apps.group.managers import _diff_sorted
+from apps.group.models import (ArchivedGroupMembership, ArchivedGroupMembershipRequest, Group, GroupClosure,
+                               GroupMembership, GroupMembershipDigest, GroupMembershipEvent, GroupMembershipRequest)
+from apps.group.permissions import ROLE_PARTICIPANT, has_group_permission, has_group_permissions
 
 # Create your tests here.
+
+class DiffSortedTest(SimpleTestCase):
+
+    def test_interleaved(self):
+        to_add, to_remove = _diff_sorted(iter([1, 3, 5, 7]), [2, 3, 6, 7, 8])
+        self.assertEqual(to_add, [2, 6, 8])
+        self.assertEqual(to_remove, [1, 5])
+
+    def test_empty_current(self):
+        self.assertEqual(_diff_sorted(iter([]), [1, 2]), ([1, 2], []))
+
+    def test_empty_desired(self):
+        self.assertEqual(_diff_sorted(iter([1, 2]), []), ([], [1, 2]))
+
+    def test_equal(self):
+        self.assertEqual(_diff_sorted(iter([1, 2, 3]), [1, 2, 3]), ([], []))
+
+
+class SyncMembersTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create(username='admin')
+        self.group, administrator = Group.objects.create_new_group(self.admin, 'sync')
+
+    def create_users(self, count):
+        User.objects.bulk_create([User(username='user-{index}'.format(index=index)) for index in range(count)])
+        return list(User.objects.exclude(pk=self.admin.pk).order_by('pk').values_list('pk', flat=True))
+
+    def member_pks(self):
+        return set(GroupMembership.objects.filter(group=self.group).values_list('member', flat=True))
+
+    def test_interleaved_add_and_remove(self):
+        pks = self.create_users(6)
+        GroupMembership.objects.sync_members(self.group, pks[0::2])
+        added, removed = GroupMembership.objects.sync_members(self.group, pks[1::2] + [pks[0]])
+        self.assertEqual((added, removed), (3, 2))
+        self.assertEqual(self.member_pks(), set(pks[1::2] + [pks[0], self.admin.pk]))
+
+    def test_admin_preserved(self):
+        pks = self.create_users(2)
+        added, removed = GroupMembership.objects.sync_members(self.group, pks + [self.admin.pk])
+        self.assertEqual((added, removed), (2, 0))
+        added, removed = GroupMembership.objects.sync_members(self.group, [])
+        self.assertEqual((added, removed), (0, 2))
+        self.assertEqual(self.member_pks(), {self.admin.pk})
+        self.assertTrue(GroupMembership.objects.filter(group=self.group, member=self.admin, permit='ADMIN').exists())
+
+    def test_unknown_users_ignored(self):
+        pks = self.create_users(2)
+        unknown = max(pks) + 1000
+        added, removed = GroupMembership.objects.sync_members(self.group, pks + [unknown])
+        self.assertEqual((added, removed), (2, 0))
+        self.assertEqual(self.member_pks(), set(pks + [self.admin.pk]))
+
+    def test_large_batch(self):
+        pks = self.create_users(600)
+        added, removed = GroupMembership.objects.sync_members(self.group, pks)
+        self.assertEqual((added, removed), (600, 0))
+
+
+class MembershipRequestTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create(username='admin')
+        self.user = User.objects.create(username='user')
+        self.group, administrator = Group.objects.create_new_group(self.admin, 'private')
+
+    def send(self, message='Hello'):
+        return GroupMembershipRequest.objects.send_membership_request(self.user, self.admin, self.group, message)
+
+    def test_one_pending_request(self):
+        self.send()
+        with self.assertRaises(SendRequestError):
+            self.send(message='Hello again')
+        self.assertEqual(GroupMembershipRequest.objects.filter(from_user=self.user).count(), 1)
+
+    def test_pending_unique_index(self):
+        request = self.send()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            GroupMembershipRequest.objects.create(from_user=self.user, to_administrator=self.admin, group=self.group)
+        GroupMembershipRequest.objects.filter(pk=request.pk).update(rejected=timezone.now())
+        self.send()
+        self.assertEqual(GroupMembershipRequest.objects.filter(from_user=self.user).count(), 2)
+
+
+class UserGroupsETagTest(TransactionTestCase):
+    """
+    Cache busting runs on commit, so these tests commit their writes.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create(username='admin')
+        self.user = User.objects.create(username='user')
+        self.public, administrator = Group.objects.create_new_group(self.admin, 'public', access='PUBLIC')
+        self.private, administrator = Group.objects.create_new_group(self.admin, 'private')
+        GroupMembership.objects.add_membership(self.user, self.public)
+
+    def get(self, etag=None):
+        request = RequestFactory().get('/', HTTP_IF_NONE_MATCH=etag) if etag else RequestFactory().get('/')
+        request.user = self.user
+        return api_user_groups(request)
+
+    def group_names(self, response):
+        return sorted(group['name'] for group in json.loads(response.content.decode('utf-8'))['groups'])
+
+    def test_not_modified(self):
+        etag = self.get()['ETag']
+        self.assertEqual(self.get(etag).status_code, 304)
+
+    def test_accepted_request_changes_etag(self):
+        etag = self.get()['ETag']
+        request = GroupMembershipRequest.objects.send_membership_request(self.user, self.admin, self.private, 'Hello')
+        request.accept_membership_request(self.admin, self.private)
+        response = self.get(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.group_names(response), ['private', 'public'])
+
+    def test_removed_membership_changes_etag(self):
+        etag = self.get()['ETag']
+        membership = GroupMembership.objects.get(member=self.user, group=self.public)
+        self.assertTrue(membership.remove_membership(self.admin))
+        response = self.get(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.group_names(response), [])
+
+    def test_removed_group_changes_etag(self):
+        etag = self.get()['ETag']
+        self.assertTrue(self.public.remove_group(self.admin))
+        response = self.get(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.group_names(response), [])
+
+
+class GroupAPIAccessTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create(username='admin')
+        self.user = User.objects.create(username='user')
+        self.private, administrator = Group.objects.create_new_group(self.admin, 'private')
+        self.public, administrator = Group.objects.create_new_group(self.admin, 'public', access='PUBLIC')
+
+    def get(self, view, group, user):
+        request = RequestFactory().get('/')
+        request.user = user
+        return view(request, group.pk)
+
+    def test_private_group_hidden_from_non_members(self):
+        for view in (api_group_detail, api_group_members):
+            self.assertEqual(self.get(view, self.private, self.user).status_code, 403)
+            self.assertEqual(self.get(view, self.private, self.admin).status_code, 200)
+            self.assertEqual(self.get(view, self.public, self.user).status_code, 200)
+
+    def test_subgroup_member_reads_private_group(self):
+        subgroup, administrator = Group.objects.create_new_group(self.admin, 'subgroup', parent=self.private)
+        GroupMembership.objects.create(member=self.user, group=subgroup, permit='PART')
+        response = self.get(api_group_members, self.private, self.user)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content.decode('utf-8'))['count'], 1)
+
+
+class CompactCodecTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create(username='admin')
+        self.user = User.objects.create(username='user')
+        self.group, administrator = Group.objects.create_new_group(self.admin, 'private')
+
+    def round_trip(self, model, instances, fields, codec=None):
+        codec = codec or CompactCodec()
+        rows = codec.decode(codec.encode(pack_instances(instances, fields)))
+        return unpack_instances(model, fields, rows)
+
+    def test_round_trip(self):
+        request = GroupMembershipRequest.objects.send_membership_request(self.user, self.admin, self.group, 'Hello')
+        request.rejected = timezone.now()
+        fields = ('id', 'from_user_id', 'group_id', 'message', 'created', 'rejected', 'viewed')
+        [unpacked] = self.round_trip(GroupMembershipRequest, [request], fields)
+        self.assertEqual([getattr(unpacked, field) for field in fields], [getattr(request, field) for field in fields])
+        self.assertTrue(timezone.is_aware(unpacked.created))
+        self.assertIsNone(unpacked.viewed)
+        [group] = self.round_trip(Group, [self.group], ('id', 'name', 'created'))
+        self.assertIsInstance(group.created, datetime.date)
+        self.assertEqual(group.created, self.group.created)
+
+    def test_compression_threshold(self):
+        codec = CompactCodec(threshold=100)
+        small, large = ['x'] * 10, ['x'] * 100
+        self.assertEqual(codec.encode(small)[:1], CompactCodec.RAW)
+        self.assertEqual(codec.encode(large)[:1], CompactCodec.ZLIB)
+        self.assertEqual(codec.decode(codec.encode(large)), large)
+        self.assertEqual(CompactCodec(threshold=None).encode(large)[:1], CompactCodec.RAW)
+
+    def test_deferred_fields(self):
+        [group] = self.round_trip(Group, [self.group], ('id', 'name'))
+        self.assertEqual(group.get_deferred_fields(), {'access', 'created', 'parent_id'})
+        with self.assertNumQueries(1):
+            self.assertEqual(group.access, 'PRIVATE')
+
+    def test_codec_setting(self):
+        self.assertIsInstance(get_codec(), CompactCodec)
+        with override_settings(GROUP_CACHE_CODEC='apps.group.caches.PickleCodec'):
+            self.assertIsInstance(get_codec(), PickleCodec)
+        with override_settings(GROUP_CACHE_CODEC_OPTIONS={'threshold': 1}):
+            self.assertEqual(get_codec().threshold, 1)
+        self.assertIsInstance(get_codec(), CompactCodec)
+        self.assertEqual(get_codec().threshold, 4096)
+
+
+@override_settings(GROUP_CACHE_CHUNK_SIZE=64)
+class ChunkedCacheTest(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.key = make_key('groups', 1)
+        self.value = [[index, 'group-{index}'.format(index=index)] for index in range(50)]
+
+    def test_round_trip(self):
+        cache_set(self.key, self.value)
+        manifest = cache.get(self.key)
+        self.assertIsInstance(manifest, dict)
+        self.assertGreater(manifest['chunks'], 1)
+        self.assertEqual(cache_get(self.key), self.value)
+
+    def test_small_value_not_chunked(self):
+        cache_set(self.key, [1])
+        self.assertNotIsInstance(cache.get(self.key), dict)
+        self.assertEqual(cache_get(self.key), [1])
+
+    def test_missing_chunk_is_a_miss(self):
+        cache_set(self.key, self.value)
+        chunk_keys = make_chunk_keys(self.key, cache.get(self.key))
+        cache.delete(chunk_keys[-1])
+        self.assertIsNone(cache_get(self.key))
+
+    def test_bust_manifest(self):
+        cache_set(self.key, self.value)
+        chunk_keys = make_chunk_keys(self.key, cache.get(self.key))
+        cache_bust([('groups', 1)])
+        self.assertIsNone(cache_get(self.key))
+        cache_set(self.key, [[0, 'new']] * 50)
+        self.assertTrue(set(chunk_keys).isdisjoint(make_chunk_keys(self.key, cache.get(self.key))))
+        self.assertEqual(cache_get(self.key), [[0, 'new']] * 50)
+
+    def test_set_many_writes_chunks_first(self):
+        values = {make_key('groups', pk): self.value for pk in (1, 2)}
+        with mock.patch.object(cache, 'set_many', wraps=cache.set_many) as set_many:
+            self.assertEqual(cache_set_many(values, batch_size=3), 2)
+        written = [key for call in set_many.call_args_list for key in call[0][0]]
+        manifests = [written.index(key) for key in values]
+        chunks = [index for index, key in enumerate(written) if key not in values]
+        self.assertGreater(min(manifests), max(chunks))
+        for key in values:
+            self.assertEqual(cache_get(key), self.value)
+
+
+class CacheBustTest(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.keys = [make_key('groups', 1), make_key('groups', 2)]
+        cache.set_many({key: 'cached' for key in self.keys})
+
+    def test_bust_on_commit(self):
+        with transaction.atomic():
+            cache_bust([('groups', 1)])
+            self.assertEqual(cache.get(self.keys[0]), 'cached')
+        self.assertIsNone(cache.get(self.keys[0]))
+
+    def test_rolled_back_keys_dropped(self):
+        try:
+            with transaction.atomic():
+                cache_bust([('groups', 1)])
+                raise ValueError
+        except ValueError:
+            pass
+        with transaction.atomic():
+            cache_bust([('groups', 2)])
+        self.assertEqual(cache.get(self.keys[0]), 'cached')
+        self.assertIsNone(cache.get(self.keys[1]))
+
+    def test_rolled_back_savepoint_keys_dropped(self):
+        with transaction.atomic():
+            cache_bust([('groups', 1)])
+            try:
+                with transaction.atomic():
+                    cache_bust([('groups', 2)])
+                    raise ValueError
+            except ValueError:
+                pass
+        self.assertIsNone(cache.get(self.keys[0]))
+        self.assertEqual(cache.get(self.keys[1]), 'cached')
+
+    def test_one_delete_per_transaction(self):
+        with mock.patch.object(cache, 'delete_many', wraps=cache.delete_many) as delete_many:
+            with transaction.atomic():
+                for pk in (1, 2):
+                    with transaction.atomic():
+                        cache_bust([('groups', pk)])
+                cache_bust([('groups', 1)])
+            self.assertEqual(delete_many.call_count, 1)
+        self.assertIsNone(cache.get(self.keys[0]))
+        self.assertIsNone(cache.get(self.keys[1]))
+
+    @override_settings(GROUP_CACHE_DOUBLE_DELETE_DELAY=0.05)
+    def test_double_delete(self):
+        threads = threading.active_count()
+        for index in range(20):
+            cache_bust([('groups', 1)])
+        self.assertLessEqual(threading.active_count(), threads + 1)
+        cache.set(self.keys[0], 'stale')
+        time.sleep(0.2)
+        self.assertIsNone(cache.get(self.keys[0]))
+
+
+class WarmCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create(username='admin')
+        self.user = User.objects.create(username='user')
+        self.group, administrator = Group.objects.create_new_group(self.admin, 'private')
+        GroupMembership.objects.create(member=self.user, group=self.group, permit='PART')
+        other = User.objects.create(username='other')
+        GroupMembershipRequest.objects.send_membership_request(other, self.admin, self.group, 'Hello')
+        cache.clear()
+
+    def test_warm_cache(self):
+        self.assertGreater(warm_cache(), 0)
+        with self.assertNumQueries(0):
+            memberships, members = GroupMembership.objects.memberships(self.group)
+            groups = Group.objects.get_user_groups(self.user)
+            requests = GroupMembershipRequest.objects.requests(self.admin)
+        self.assertEqual(sorted(member.pk for member in members), [self.admin.pk, self.user.pk])
+        self.assertEqual([group.pk for group in groups], [self.group.pk])
+        self.assertEqual(len(requests), 1)
+
+    def test_warmup_lock(self):
+        self.assertTrue(acquire_warmup_lock())
+        self.assertFalse(acquire_warmup_lock())
+
+    def test_management_commands(self):
+        self.assertTrue(is_management_command(['manage.py', 'migrate']))
+        self.assertTrue(is_management_command(['/usr/bin/django-admin', 'makemigrations']))
+        self.assertTrue(is_management_command(['/usr/lib/python3/site-packages/django/__main__.py', 'migrate']))
+        self.assertFalse(is_management_command(['/usr/bin/gunicorn', 'project.wsgi']))
+
+    @override_settings(GROUP_CACHE_WARMUP=True)
+    def test_one_process_warms(self):
+        config = apps.get_app_config('group')
+        with mock.patch('apps.group.apps.threading.Thread') as thread:
+            with mock.patch('apps.group.apps.is_management_command', return_value=True):
+                config.warm_cache()
+            self.assertFalse(thread.called)
+            with mock.patch('apps.group.apps.is_management_command', return_value=False):
+                config.warm_cache()
+                config.warm_cache()
+        self.assertEqual(thread.call_count, 1)
+
+
+class GroupClosureTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create(username='admin')
+        self.root, administrator = Group.objects.create_new_group(self.admin, 'root')
+        self.child, administrator = Group.objects.create_new_group(self.admin, 'child', parent=self.root)
+        self.leaf, administrator = Group.objects.create_new_group(self.admin, 'leaf', parent=self.child)
+        self.other, administrator = Group.objects.create_new_group(self.admin, 'other')
+
+    def links(self):
+        return set(GroupClosure.objects.values_list('ancestor', 'descendant', 'depth'))
+
+    def expected_links(self, parents):
+        links = set()
+        for group, parent in parents.items():
+            ancestor, depth = group, 0
+            while ancestor is not None:
+                links.add((ancestor.pk, group.pk, depth))
+                ancestor, depth = parents[ancestor], depth + 1
+        return links
+
+    def test_add_node(self):
+        parents = {self.root: None, self.child: self.root, self.leaf: self.child, self.other: None}
+        self.assertEqual(self.links(), self.expected_links(parents))
+
+    def test_move_node(self):
+        Group.objects.set_parent(self.admin, self.child, self.other)
+        parents = {self.root: None, self.child: self.other, self.leaf: self.child, self.other: None}
+        self.assertEqual(self.links(), self.expected_links(parents))
+        Group.objects.set_parent(self.admin, self.child, None)
+        parents[self.child] = None
+        self.assertEqual(self.links(), self.expected_links(parents))
+
+    def test_move_under_descendant(self):
+        for parent in (self.root, self.leaf):
+            with self.assertRaises(GroupError), transaction.atomic():
+                Group.objects.set_parent(self.admin, self.root, parent)
+        self.assertIsNone(Group.objects.get(pk=self.root.pk).parent)
+
+    def test_rebuild(self):
+        Group.objects.set_parent(self.admin, self.child, self.other)
+        links = self.links()
+        GroupClosure.objects.all().delete()
+        self.assertEqual(GroupClosure.objects.rebuild(), len(links))
+        self.assertEqual(self.links(), links)
+
+    def test_rebuild_many_groups(self):
+        Group.objects.bulk_create([Group(name='bulk-{index}'.format(index=index), access='PUBLIC')
+                                   for index in range(600)])
+        self.assertEqual(GroupClosure.objects.rebuild(), 600 + 1 + 2 + 3 + 1)
+
+
+class RolesTest(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create(username='owner')
+        self.moderator = User.objects.create(username='moderator')
+        self.user = User.objects.create(username='user')
+        self.group, administrator = Group.objects.create_new_group(self.owner, 'group', access='PUBLIC')
+        for user in (self.moderator, self.user):
+            GroupMembership.objects.add_membership(user, self.group)
+        GroupMembership.objects.grant_role(self.moderator, self.group, 'MODERATOR', granted_by=self.owner)
+
+    def membership(self, user):
+        return GroupMembership.objects.get(member=user, group=self.group)
+
+    def test_moderator_removes_member(self):
+        self.assertTrue(self.membership(self.user).remove_membership(self.moderator))
+        self.assertFalse(GroupMembership.objects.is_member(self.user, self.group))
+
+    def test_moderator_cannot_remove_owner(self):
+        self.assertFalse(self.membership(self.owner).remove_membership(self.moderator))
+        self.assertTrue(GroupMembership.objects.is_member(self.owner, self.group))
+
+    def test_participant_cannot_remove_member(self):
+        self.assertFalse(self.membership(self.moderator).remove_membership(self.user))
+        self.assertTrue(GroupMembership.objects.is_member(self.moderator, self.group))
+
+    def test_manage_roles_required(self):
+        with self.assertRaises(GroupAdministratorError):
+            GroupMembership.objects.grant_role(self.user, self.group, 'MODERATOR', granted_by=self.moderator)
+        with self.assertRaises(GroupAdministratorError):
+            GroupMembership.objects.revoke_role(self.moderator, self.group, 'MODERATOR', revoked_by=self.user)
+        GroupMembership.objects.revoke_role(self.moderator, self.group, 'MODERATOR', revoked_by=self.owner)
+        self.assertEqual(self.membership(self.moderator).roles, ROLE_PARTICIPANT)
+
+    def test_edit_group_required(self):
+        other, administrator = Group.objects.create_new_group(self.user, 'other')
+        with self.assertRaises(GroupAdministratorError):
+            Group.objects.set_parent(self.user, other, self.group)
+        with self.assertRaises(GroupAdministratorError):
+            Group.objects.create_new_group(self.user, 'subgroup', parent=self.group)
+
+    def test_moderator_inbox(self):
+        private, administrator = Group.objects.create_new_group(self.owner, 'private')
+        GroupMembership.objects.create(member=self.moderator, group=private, permit='PART')
+        GroupMembership.objects.grant_role(self.moderator, private, 'MODERATOR', granted_by=self.owner)
+        requester = User.objects.create(username='requester')
+        self.assertEqual(GroupMembershipRequest.objects.requests(self.moderator), [])
+        request = GroupMembershipRequest.objects.send_membership_request(requester, self.owner, private, 'Hello')
+        api_request = RequestFactory().get('/')
+        api_request.user = self.moderator
+        data = json.loads(api_membership_requests(api_request).content.decode('utf-8'))
+        self.assertEqual([item['id'] for item in data['requests']], [request.pk])
+        unviewed = GroupMembershipRequest.objects.unviewed_requests(self.moderator)
+        self.assertEqual([item.pk for item in unviewed], [request.pk])
+        self.assertEqual(GroupMembershipRequest.objects.requests(self.user), [])
+        self.assertTrue(request.accept_membership_request(self.moderator, private))
+        self.assertTrue(GroupMembership.objects.is_member(requester, private))
+        self.assertEqual(GroupMembershipRequest.objects.requests(self.moderator), [])
+        self.assertEqual(GroupMembershipRequest.objects.requests(self.owner), [])
+
+    def test_revoked_moderator_inbox(self):
+        requester = User.objects.create(username='requester')
+        private, administrator = Group.objects.create_new_group(self.owner, 'private')
+        GroupMembership.objects.create(member=self.moderator, group=private, permit='PART')
+        GroupMembership.objects.grant_role(self.moderator, private, 'MODERATOR', granted_by=self.owner)
+        GroupMembershipRequest.objects.send_membership_request(requester, self.owner, private, 'Hello')
+        self.assertEqual(len(GroupMembershipRequest.objects.requests(self.moderator)), 1)
+        GroupMembership.objects.revoke_role(self.moderator, private, 'MODERATOR', revoked_by=self.owner)
+        self.assertEqual(GroupMembershipRequest.objects.requests(self.moderator), [])
+
+    def test_with_role(self):
+        moderators = GroupMembership.objects.with_role(self.group, 'MODERATOR')
+        self.assertEqual([membership.member_id for membership in moderators], [self.moderator.pk])
+
+    def test_custom_roles(self):
+        roles = {
+            'PARTICIPANT': (ROLE_PARTICIPANT, ['manage_requests']),
+            'EDITOR': (1 << 20, ['edit_group']),
+        }
+        with override_settings(GROUP_ROLES=roles):
+            cache.clear()
+            self.assertTrue(has_group_permission(self.user, self.group, 'manage_requests'))
+            GroupMembership.objects.grant_role(self.user, self.group, 'EDITOR', granted_by=self.owner)
+            self.assertTrue(has_group_permission(self.user, self.group, 'edit_group'))
+            editors = GroupMembership.objects.with_role(self.group, 'EDITOR')
+            self.assertEqual([membership.member_id for membership in editors], [self.user.pk])
+
+
+class MembershipEventTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create(username='admin')
+        self.user = User.objects.create(username='user')
+        self.group, administrator = Group.objects.create_new_group(self.admin, 'private')
+
+    def events(self, user):
+        return list(GroupMembershipEvent.objects.filter(user_id=user.pk).order_by('pk')
+                    .values_list('event', flat=True))
+
+    def test_feed_pages(self):
+        GroupMembershipEvent.objects.all().delete()
+        events = [GroupMembershipEvent.objects.log(self.group, self.user, GroupMembershipEvent.JOINED)
+                  for index in range(4)]
+        pks = [event.pk for event in reversed(events)]
+        page, cursor = GroupMembershipEvent.objects.group_feed(self.group, limit=3)
+        self.assertEqual([event.pk for event in page], pks[:3])
+        self.assertEqual(cursor, pks[2])
+        page, cursor = GroupMembershipEvent.objects.group_feed(self.group, cursor=cursor, limit=3)
+        self.assertEqual([event.pk for event in page], pks[3:])
+        self.assertIsNone(cursor)
+        page, cursor = GroupMembershipEvent.objects.user_feed(self.user, limit=2)
+        self.assertEqual([event.pk for event in page], pks[:2])
+        page, cursor = GroupMembershipEvent.objects.user_feed(self.user, cursor=cursor, limit=2)
+        self.assertEqual([event.pk for event in page], pks[2:])
+        self.assertIsNone(cursor)
+
+    def test_prune_whole_partitions(self):
+        GroupMembershipEvent.objects.all().delete()
+        for day in (datetime.datetime(2026, 1, 31), datetime.datetime(2026, 2, 1), datetime.datetime(2026, 3, 20)):
+            created = timezone.make_aware(day)
+            GroupMembershipEvent.objects.create(group_id=self.group.pk, user_id=self.user.pk, created=created,
+                                                event=GroupMembershipEvent.JOINED,
+                                                partition=GroupMembershipEvent.objects.partition(created))
+        before = timezone.make_aware(datetime.datetime(2026, 2, 15))
+        self.assertEqual(GroupMembershipEvent.objects.prune(before, batch_size=1), 1)
+        self.assertEqual(sorted(GroupMembershipEvent.objects.values_list('partition', flat=True)), [202602, 202603])
+
+    def test_join_and_leave_events(self):
+        public, administrator = Group.objects.create_new_group(self.admin, 'public', access='PUBLIC')
+        GroupMembership.objects.add_membership(self.user, public)
+        GroupMembership.objects.get(member=self.user, group=public).remove_membership(self.user)
+        self.assertEqual(self.events(self.user), [GroupMembershipEvent.JOINED, GroupMembershipEvent.LEFT])
+        self.assertEqual(self.events(self.admin), [GroupMembershipEvent.JOINED, GroupMembershipEvent.JOINED])
+
+    def test_request_events(self):
+        other = User.objects.create(username='other')
+        for user in (self.user, other):
+            GroupMembershipRequest.objects.send_membership_request(user, self.admin, self.group, 'Hello')
+        GroupMembershipRequest.objects.get(from_user=self.user).accept_membership_request(self.admin, self.group)
+        GroupMembershipRequest.objects.get(from_user=other).reject_membership_request(self.admin, self.group)
+        self.assertEqual(self.events(self.user), [GroupMembershipEvent.ACCEPTED])
+        self.assertEqual(self.events(other), [GroupMembershipEvent.REJECTED])
+
+    def test_sync_events(self):
+        GroupMembership.objects.sync_members(self.group, [self.user.pk])
+        GroupMembership.objects.sync_members(self.group, [])
+        self.assertEqual(self.events(self.user), [GroupMembershipEvent.JOINED, GroupMembershipEvent.LEFT])
+
+
+class PermissionBatchTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create(username='admin')
+        self.moderator = User.objects.create(username='moderator')
+        self.groups = []
+        for index in range(6):
+            group, administrator = Group.objects.create_new_group(self.admin, 'group-{index}'.format(index=index))
+            user = User.objects.create(username='user-{index}'.format(index=index))
+            GroupMembershipRequest.objects.send_membership_request(user, self.admin, group, 'Hello')
+            self.groups.append(group)
+        GroupMembership.objects.create(member=self.moderator, group=self.groups[0], permit='PART')
+        GroupMembership.objects.grant_role(self.moderator, self.groups[0], 'MODERATOR', granted_by=self.admin)
+        cache.clear()
+
+    def test_has_group_permissions(self):
+        with self.assertNumQueries(1):
+            allowed = has_group_permissions(self.moderator, self.groups, 'manage_requests')
+        self.assertEqual(allowed, {group.pk: group == self.groups[0] for group in self.groups})
+        with self.assertNumQueries(0):
+            self.assertEqual(has_group_permissions(self.moderator, self.groups, 'manage_requests'), allowed)
+            self.assertFalse(has_group_permission(self.moderator, self.groups[0], 'remove_group'))
+
+    def test_bulk_inbox_fixed_queries(self):
+        for count in (2, 6):
+            GroupMembershipRequest.objects.update(viewed=None)
+            requests = list(GroupMembershipRequest.objects.filter(group__in=self.groups[:count]))
+            cache.clear()
+            with self.assertNumQueries(5):
+                marked = GroupMembershipRequest.objects.mark_viewed_requests(self.admin, requests)
+            self.assertEqual(marked, count)
+        self.assertFalse(GroupMembershipRequest.objects.filter(viewed__isnull=True).exists())
+
+    def test_bulk_inbox_checks_permissions(self):
+        requests = list(GroupMembershipRequest.objects.all())
+        self.assertEqual(GroupMembershipRequest.objects.mark_viewed_requests(self.moderator, requests), 1)
+        viewed = GroupMembershipRequest.objects.filter(viewed__isnull=False).values_list('group', flat=True)
+        self.assertEqual(list(viewed), [self.groups[0].pk])
+
+
+@override_settings(GROUP_ARCHIVE_ON_DELETE=True)
+class ArchiveTest(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create(username='admin')
+        self.user = User.objects.create(username='user')
+        self.group, administrator = Group.objects.create_new_group(self.admin, 'private')
+
+    def send(self):
+        return GroupMembershipRequest.objects.send_membership_request(self.user, self.admin, self.group, 'Hello')
+
+    def outcomes(self):
+        return list(ArchivedGroupMembershipRequest.objects.user_history(self.user).values_list('outcome', flat=True))
+
+    def test_accepted_request(self):
+        self.send().accept_membership_request(self.admin, self.group)
+        self.assertEqual(self.outcomes(), [ArchivedGroupMembershipRequest.ACCEPTED])
+
+    def test_withdrawn_request(self):
+        self.send().remove_sent_request(self.user)
+        self.assertEqual(self.outcomes(), [ArchivedGroupMembershipRequest.WITHDRAWN])
+
+    def test_membership_outcomes(self):
+        self.send().accept_membership_request(self.admin, self.group)
+        GroupMembership.objects.get(member=self.user, group=self.group).remove_membership(self.admin)
+        history = ArchivedGroupMembership.objects.user_history(self.user)
+        self.assertEqual(list(history.values_list('outcome', flat=True)), [ArchivedGroupMembership.REMOVED])
+
+    def test_sync_removals_archived(self):
+        users = [User.objects.create(username='member-{index}'.format(index=index)) for index in range(3)]
+        GroupMembership.objects.sync_members(self.group, [user.pk for user in users])
+        self.assertEqual(GroupMembership.objects.sync_members(self.group, [users[0].pk], batch_size=1), (0, 2))
+        history = ArchivedGroupMembership.objects.group_history(self.group)
+        self.assertEqual(sorted(history.values_list('member', 'outcome')),
+                         [(user.pk, ArchivedGroupMembership.REMOVED) for user in users[1:]])
+        self.assertEqual(GroupMembership.objects.filter(group=self.group).count(), 2)
+
+    def test_archive_command(self):
+        old = timezone.now() - datetime.timedelta(days=100)
+        request = self.send()
+        GroupMembershipRequest.objects.filter(pk=request.pk).update(created=old)
+        other = User.objects.create(username='other', is_active=False)
+        GroupMembership.objects.create(member=other, group=self.group, permit='PART')
+        self.admin.is_active = False
+        self.admin.save()
+        call_command('archive_group_records', inactive_members=True, stdout=io.StringIO())
+        self.assertEqual(self.outcomes(), [ArchivedGroupMembershipRequest.EXPIRED])
+        self.assertEqual(list(GroupMembership.objects.filter(group=self.group).values_list('member', flat=True)),
+                         [self.admin.pk])
+        history = ArchivedGroupMembership.objects.group_history(self.group)
+        self.assertEqual(list(history.values_list('member', 'outcome')), [(other.pk, ArchivedGroupMembership.INACTIVE)])
+
+
+@override_settings(GROUP_ARCHIVE_ON_DELETE=True)
+class LoadTestCommandTest(TransactionTestCase):
+
+    def test_cleanup(self):
+        call_command('group_loadtest', users=6, groups=2, threads=1, operations=40, seed=1, stdout=io.StringIO())
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(Group.objects.exists())
+        self.assertFalse(GroupMembershipEvent.objects.exists())
+        self.assertFalse(ArchivedGroupMembership.objects.exists())
+        self.assertFalse(ArchivedGroupMembershipRequest.objects.exists())
+
+
+class ImportTimeTest(SimpleTestCase):
+    """
+    Keep the import time of the app modules, measured with
+    "python -X importtime" in a fresh interpreter, under a budget.
+    """
+    budget_ms = 100
+
+    def test_import_time(self):
+        package = apps.get_app_config('group').name
+        timings = ImportTimeCommand().measure(package)
+        self.assertIn(package, timings)
+        total = sum(own for own, cumulative in timings.values()) / 1000.0
+        self.assertLessEqual(total, self.budget_ms)
+
+
+class ListDigestBackend(BaseDigestBackend):
+    """
+    Keep the delivered digests in a list, failing
+    after 'fail_after' batches when it is set.
+    """
+
+    def __init__(self, fail_after=None):
+        self.digests = []
+        self.batches = 0
+        self.fail_after = fail_after
+
+    @property
+    def requests(self):
+        return [request for recipient, requests in self.digests for request in requests]
+
+    def send_digests(self, digests):
+        if self.batches == self.fail_after:
+            raise IOError('Delivery failed.')
+        self.batches += 1
+        for digest in digests:
+            self.digests.append((digest['administrator'].pk, [request.pk for request in digest['requests']]))
+        return len(digests)
+
+
+class DigestTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create(username='admin')
+        self.group, administrator = Group.objects.create_new_group(self.admin, 'private')
+
+    def send(self, username, group=None, minutes_ago=0):
+        group = group or self.group
+        user = User.objects.create(username=username)
+        administrator = GroupMembership.objects.get_group_admin(group)
+        request = GroupMembershipRequest.objects.send_membership_request(user, administrator, group, 'Hello')
+        created = timezone.now() - datetime.timedelta(minutes=minutes_ago)
+        GroupMembershipRequest.objects.filter(pk=request.pk).update(created=created)
+        return request
+
+    def deliver(self, backend=None, batch_size=500):
+        backend = backend or ListDigestBackend()
+        send_digests(batch_size=batch_size, backend=backend)
+        return backend.requests
+
+    def test_requests_digested_once(self):
+        first = self.send('first', minutes_ago=30)
+        old = self.send('old', minutes_ago=120)
+        self.assertEqual(self.deliver(), [old.pk, first.pk])
+        self.assertEqual(self.deliver(), [])
+        second = self.send('second')
+        self.assertEqual(self.deliver(), [second.pk])
+        runs = GroupMembershipDigest.objects.order_by('pk')
+        self.assertEqual(list(runs.values_list('delivered', flat=True)), [1, 0, 1])
+        self.assertEqual(list(runs[0].requests.order_by('pk').values_list('pk', flat=True)), [first.pk, old.pk])
+
+    def test_late_commit(self):
+        self.deliver()
+        late = self.send('late', minutes_ago=120)
+        self.assertEqual(self.deliver(), [late.pk])
+
+    def test_failed_delivery(self):
+        owner = User.objects.create(username='owner')
+        other, administrator = Group.objects.create_new_group(owner, 'other')
+        first = self.send('first')
+        second = self.send('second', group=other)
+        with self.assertRaises(IOError):
+            self.deliver(backend=ListDigestBackend(fail_after=1), batch_size=1)
+        self.assertEqual(GroupMembershipDigest.objects.get().delivered, 1)
+        self.assertIsNotNone(GroupMembershipRequest.objects.get(pk=first.pk).digest)
+        self.assertIsNone(GroupMembershipRequest.objects.get(pk=second.pk).digest)
+        self.assertEqual(self.deliver(), [second.pk])
+
+    def test_moderator_digest(self):
+        moderator = User.objects.create(username='moderator')
+        GroupMembership.objects.create(member=moderator, group=self.group, permit='PART')
+        GroupMembership.objects.grant_role(moderator, self.group, 'MODERATOR', granted_by=self.admin)
+        cache.clear()
+        request = self.send('user')
+        backend = ListDigestBackend()
+        self.deliver(backend=backend, batch_size=1)
+        self.assertEqual(backend.digests, [(self.admin.pk, [request.pk]), (moderator.pk, [request.pk])])
+
+    def test_viewed_requests_skipped(self):
+        request = self.send('viewed')
+        self.assertTrue(request.mark_viewed_membership_request(self.admin, self.group))
+        self.assertEqual(self.deliver(), [])
+        self.assertTrue(request.unmark_viewed_membership_request(self.admin, self.group))
+        self.assertIsNone(GroupMembershipRequest.objects.get(pk=request.pk).viewed)
+        self.assertEqual(self.deliver(), [request.pk])
@@ -0,0 +1,52 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+# Create your throttles here.
+
+THROTTLE_KEY = 'grp_th-{scope}-{pk}-{window}'
+
+# Number of allowed membership requests per period (seconds)
+# for each user sending them and each administrator receiving them.
+THROTTLE_RATES = {
+    'user': (5, 3600),
+    'admin': (50, 3600),
+}
+
+
+def get_rate(scope):
+    """
+    Return the (limit, period) rate for a throttle scope.
+    Rates can be overridden with the GROUP_REQUEST_THROTTLE_RATES setting.
+    """
+    rates = getattr(settings, 'GROUP_REQUEST_THROTTLE_RATES', {})
+    return rates.get(scope, THROTTLE_RATES[scope])
+
+
+def consume(scope, pk):
+    """
+    Consume one request from the current window of a throttle scope.
+    The counter lives in the cache and is updated with atomic add/incr
+    operations so concurrent workers share the same budget.
+    Return True if the request is allowed.
+    """
+    limit, period = get_rate(scope)
+    window = int(time.time() // period)
+    key = THROTTLE_KEY.format(scope=scope, pk=pk, window=window)
+    cache.add(key, 0, timeout=period)
+    try:
+        count = cache.incr(key)
+    except ValueError:
+        # The key expired between add and incr.
+        cache.add(key, 1, timeout=period)
+        count = 1
+    return count <= limit
+
+
+def allow_membership_request(from_user, to_admin):
+    """
+    Check the sender and the administrator budgets
+    before creating a new membership request.
+    """
+    return consume('user', from_user.pk) and consume('admin', to_admin.pk)
@@ -1,6 +1,6 @@
 from django.conf.urls import url
 
-from . import views
+from . import api, views
 
 # Create your urls here.
 
@@ -40,4 +40,34 @@ urlpatterns = [
         view=views.send_group_membership_request,
         name='membership_request',
     ),
+    url(
+        regex=r'^api/$',
+        view=api.api_user_groups,
+        name='api_group_list',
+    ),
+    url(
+        regex=r'^api/(?P<group_id>\d+)/$',
+        view=api.api_group_detail,
+        name='api_group_detail',
+    ),
+    url(
+        regex=r'^api/(?P<group_id>\d+)/members/$',
+        view=api.api_group_members,
+        name='api_group_members',
+    ),
+    url(
+        regex=r'^api/requests/$',
+        view=api.api_membership_requests,
+        name='api_membership_requests',
+    ),
+    url(
+        regex=r'^api/(?P<group_id>\d+)/activity/$',
+        view=api.api_group_activity,
+        name='api_group_activity',
+    ),
+    url(
+        regex=r'^api/activity/$',
+        view=api.api_user_activity,
+        name='api_user_activity',
+    ),
 ]
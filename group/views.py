@@ -2,6 +2,8 @@ from django.contrib.auth.decorators import login_required
 from django.shortcuts import redirect, render
 from django.views.decorators.http import require_http_methods
 
+from .decorators import group_permission_required
+from .exceptions import RequestThrottledError, SendRequestError
 from .forms import GroupCreationForm, GroupMembershipRequestForm
 from .models import Group, GroupMembership
 
@@ -17,7 +19,7 @@ def create_group(request, template='group_create.html'):
         form = GroupCreationForm(request.POST)
         if form.is_valid():
             group, admin = form.save(request=request)
-            return redirect('group_detail', group_id=group.pk)
+            return redirect('group:group_detail', group_id=group.pk)
     form = GroupCreationForm()
     return render(request, template, {'form': form})
 
@@ -52,8 +54,8 @@ def join_group(request, group_id):
     request to the administrator for membership approval.
     """
     group = Group.objects.get(pk=group_id)
-    redirect = GroupMembership.objects.add_membership(user=request.user, group=group)
-    return redirect
+    url = GroupMembership.objects.add_membership(user=request.user, group=group)
+    return redirect(url)
 
 
 @login_required(login_url='/login/')
@@ -66,6 +68,7 @@ def list_group_members(request, group_id, template='group_members.html'):
 
 
 @login_required(login_url='/login/')
+@group_permission_required('remove_group')
 def remove_group(request, group_id, template='group_remove.html'):
     """
     Remove a group.
@@ -83,12 +86,21 @@ def send_group_membership_request(request, group_id, template='group_send_reques
     """
     Send membership request to the administrator
     of a private group.
+    Throttled requests are answered with status 429 and
+    a request already pending shows a form error.
     """
     if request.method == 'POST':
         form = GroupMembershipRequestForm(request.POST)
         if form.is_valid():
             group = Group.objects.get(pk=group_id)
-            form.save(user=request.user, group=group)
+            try:
+                form.save(user=request.user, group=group)
+            except RequestThrottledError as error:
+                form.add_error(None, error)
+                return render(request, template, {'form': form}, status=429)
+            except SendRequestError as error:
+                form.add_error(None, error)
+                return render(request, template, {'form': form})
             return redirect('group:group_list')
     form = GroupMembershipRequestForm()
     return render(request, template, {'form': form})